@@ -0,0 +1,15 @@
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from services.token_cache import token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для известных токенов."""
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key, lambda: self.load_user(key))
+        return user, Token(key=key, user=user)
+
+    def load_user(self, key):
+        return super().authenticate_credentials(key)[0]
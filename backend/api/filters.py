@@ -1,6 +1,17 @@
 import django_filters as filters
 
 from recipes.models import Ingredient, Recipe, Tag
+from services import membership
+
+
+class StableOrderingFilter(filters.OrderingFilter):
+    """Сортировка с id в конце, чтобы порядок страниц был однозначным."""
+
+    def filter(self, qs, value):
+        qs = super().filter(qs, value)
+        if value and not {'id', '-id'} & set(qs.query.order_by):
+            qs = qs.order_by(*qs.query.order_by, '-id')
+        return qs
 
 
 class RecipeFilter(filters.FilterSet):
@@ -15,19 +26,44 @@ class RecipeFilter(filters.FilterSet):
     is_favorited = filters.NumberFilter(
         method='filter_is_favorited'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = StableOrderingFilter(fields=(
+        'id',
+        'cooking_time',
+        'favorites_count',
+        'shopping_cart_count'
+    ))
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_in_shopping_cart', 'is_favorited')
+        fields = (
+            'author',
+            'tags',
+            'is_in_shopping_cart',
+            'is_favorited',
+            'search',
+            'ordering'
+        )
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
+        # id отсортированы: одинаковый набор дает одинаковый SQL,
+        # а значит и один ключ кэша COUNT(*) в пагинации.
         if self.request.user.is_authenticated and value:
-            return queryset.filter(in_shopping_cart__user=self.request.user)
+            return queryset.filter(id__in=sorted(membership.get_recipe_ids(
+                self.request.user, membership.SHOPPING_CART
+            )))
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(in_favorites__user=self.request.user)
+            return queryset.filter(id__in=sorted(membership.get_recipe_ids(
+                self.request.user, membership.FAVORITES
+            )))
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value.strip())
         return queryset
 
 
@@ -0,0 +1,236 @@
+import cProfile
+import json
+import logging
+import marshal
+import pstats
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from services import instrumentation, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware:
+    """Время запроса, число и время SQL-запросов, время сериализации.
+
+    Итог отдается в заголовке Server-Timing и попадает в метрики
+    services.metrics с меткой имени маршрута. Запросы дольше
+    SLOW_REQUEST_THRESHOLD_MS пишутся в лог с вероятностью
+    SLOW_REQUEST_SAMPLE_RATE.
+
+    У потокового ответа заголовки уходят раньше тела, поэтому
+    Server-Timing в нем нет, а метрики записываются после отдачи
+    тела вместе с его запросами.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(request_metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(request_metrics)
+                    )
+                response = self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response,
+                request_metrics
+            )
+            return response
+        request_metrics.finish()
+        response['Server-Timing'] = request_metrics.server_timing()
+        self.record(request, response, request_metrics)
+        return response
+
+    def stream(self, content, request, response, request_metrics):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(request_metrics)
+                )
+            try:
+                yield from content
+            finally:
+                request_metrics.finish()
+                self.record(request, response, request_metrics)
+
+    def record(self, request, response, request_metrics):
+        match = request.resolver_match
+        metrics.observe_request(
+            (match.url_name or match.view_name) if match else 'unmatched',
+            request.method,
+            response.status_code,
+            request_metrics
+        )
+        if (
+            request_metrics.duration * 1000
+            >= settings.SLOW_REQUEST_THRESHOLD_MS
+            and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE
+        ):
+            self.log_slow_request(request, response, request_metrics)
+
+    @staticmethod
+    def log_slow_request(request, response, metrics):
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        logger.warning('slow request %s', json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.url_name if match else None,
+            'status': response.status_code,
+            'user_id': getattr(user, 'id', None),
+            'duration_ms': round(metrics.duration * 1000, 1),
+            'db_queries': metrics.queries,
+            'db_ms': round(metrics.sql_time * 1000, 1),
+            'serializer_ms': round(metrics.serializer_time * 1000, 1),
+        }))
+
+
+class ProfilerMiddleware:
+    """Профилирование одного запроса по просьбе персонала.
+
+    Включается параметром ?__profile= или заголовком X-Profile.
+    Значение prof отдает файл для pstats/snakeviz, любое другое —
+    JSON с самыми дорогими функциями и списком SQL-запросов.
+    Запросы без этого признака проходят без изменений.
+    """
+    query_param = '__profile'
+    header = 'X-Profile'
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.GET.get(self.query_param)
+        if mode is None:
+            mode = request.headers.get(self.header)
+        if mode is None or not self.is_staff(request):
+            return self.get_response(request)
+
+        query_log = instrumentation.QueryLog()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+        stats = pstats.Stats(profiler)
+
+        if mode == 'prof':
+            match = request.resolver_match
+            name = match.url_name if match and match.url_name else 'request'
+            profile = HttpResponse(
+                marshal.dumps(stats.stats),
+                content_type='application/octet-stream'
+            )
+            profile['Content-Disposition'] = (
+                f'attachment; filename="{name}.prof"'
+            )
+            return profile
+
+        return JsonResponse({
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'functions': self.top_functions(stats),
+            'sql': {
+                'count': len(query_log.queries),
+                'time_ms': round(
+                    sum(query['time_ms'] for query in query_log.queries), 3
+                ),
+                'repeated': query_log.repeated(),
+                'queries': query_log.queries,
+            },
+        }, json_dumps_params={'ensure_ascii': False})
+
+    @staticmethod
+    def is_staff(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+        # Токен проверяется только для запросов с признаком профилирования.
+        drf_request = Request(request, authenticators=[
+            authentication()
+            for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ])
+        try:
+            return drf_request.user.is_staff
+        except APIException:
+            return False
+
+    @staticmethod
+    def top_functions(stats):
+        stats.sort_stats('cumulative')
+        functions = []
+        for function in stats.fcn_list[:settings.PROFILER_TOP_FUNCTIONS]:
+            _, calls, own_time, cumulative_time, _ = stats.stats[function]
+            filename, line, name = function
+            functions.append({
+                'function': f'{filename}:{line}({name})',
+                'calls': calls,
+                'own_ms': round(own_time * 1000, 3),
+                'cumulative_ms': round(cumulative_time * 1000, 3),
+            })
+        return functions
+
+
+class NPlusOneMiddleware:
+    """Сообщает о запросах, повторенных больше NPLUSONE_THRESHOLD раз.
+
+    Включается NPLUSONE_ENABLED (по умолчанию в DEBUG). С NPLUSONE_RAISE
+    вместо записи в лог выбрасывает NPlusOneError, чтобы тесты падали.
+    """
+
+    def __init__(self, get_response):
+        if not settings.NPLUSONE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        detector = instrumentation.NPlusOneDetector(
+            settings.NPLUSONE_THRESHOLD
+        )
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(detector))
+            response = self.get_response(request)
+            if response.streaming:
+                # Запросы генератора выполняются позже, при отдаче ответа.
+                return response
+        problems = detector.problems()
+        if problems:
+            message = (
+                f'N+1 в {request.method} {request.get_full_path()}:\n'
+                + detector.format(problems)
+            )
+            if settings.NPLUSONE_RAISE:
+                raise instrumentation.NPlusOneError(message)
+            logger.warning(message)
+        return response
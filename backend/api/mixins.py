@@ -0,0 +1,81 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from services import catalogue, instrumentation, metrics
+
+
+class CatalogueCacheMixin:
+    """Условный GET и кэш ответов для редко меняющихся справочников.
+
+    ETag и Last-Modified строятся по версии справочника catalogue_name,
+    которая меняется сигналами при сохранении и удалении записей.
+    """
+    catalogue_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogueCacheMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogueCacheMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    def cached_response(self, request, get_response, store=True):
+        state = catalogue.get_state(self.catalogue_name)
+        etag = quote_etag(md5(
+            f'{state["version"]}:{request.get_full_path()}:'
+            f'{request.accepted_media_type}'.encode()
+        ).hexdigest())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=state['modified']
+        )
+        if response is None:
+            key = f'catalogue_response:{etag}'
+            data = cache.get(key) if store else None
+            if store:
+                metrics.cache_hit('catalogue_response', data is not None)
+            if data is None:
+                response = get_response()
+                if store and response.status_code == status.HTTP_200_OK:
+                    cache.set(
+                        key, response.data, settings.CATALOGUE_CACHE_TIMEOUT
+                    )
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(state['modified'])
+        return response
+
+
+class SerializerTimingMixin:
+    """Добавляет время сериализации к метрикам текущего запроса.
+
+    Учитывается только внешний вызов, вложенные сериализаторы
+    не считаются повторно. Время включает запросы, сделанные
+    во время сериализации.
+    """
+
+    def to_representation(self, instance):
+        metrics = instrumentation.current()
+        if metrics is None or metrics.in_serializer:
+            return super().to_representation(instance)
+        metrics.in_serializer = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - start
+            metrics.in_serializer = False
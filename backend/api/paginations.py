@@ -1,6 +1,196 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который не считает COUNT(*) на каждый запрос.
+
+    Точное число строк кэшируется на PAGINATION_COUNT_TTL секунд для
+    каждого набора фильтров. Для таблиц без фильтров больше
+    PAGINATION_ESTIMATE_THRESHOLD строк на PostgreSQL берется оценка
+    планировщика из pg_class.reltuples.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_is_approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = self.estimate_count(queryset)
+        if estimate is not None:
+            self.count_is_approximate = True
+            return estimate
+
+        try:
+            query = str(queryset.order_by().values('pk').query)
+        except EmptyResultSet:
+            # Фильтр вида id__in=[] (пустое избранное или корзина):
+            # такой queryset заведомо пуст, и SQL у него нет.
+            return 0
+        key = f'pagination_count:{md5(query.encode()).hexdigest()}'
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_TTL)
+        return count
+
+    @staticmethod
+    def estimate_count(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < settings.PAGINATION_ESTIMATE_THRESHOLD:
+            return None
+        return row[0]
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с необязательным режимом курсора.
+
+    С параметром ?cursor= (можно пустым для первой страницы) страницы
+    выбираются по ключу сортировки queryset без COUNT(*) и OFFSET,
+    поэтому стоимость не зависит от глубины. Ключи ответа те же,
+    count в этом режиме равен null.
+
+    В постраничном режиме count берется из CachedCountPaginator,
+    а count_is_approximate показывает, что это оценка.
+    """
     page_size_query_param = 'limit'
     page_size = 6
+    django_paginator_class = CachedCountPaginator
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(ordering, position))
+            except (ValueError, ValidationError):
+                # Значение не подходит к типу поля, например строка для id.
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        self.next_position = self.previous_position = None
+        if results and has_next:
+            self.next_position = self.position(results[-1])
+        if results and has_previous:
+            self.previous_position = self.position(results[0])
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            response = super().get_paginated_response(data)
+            response.data['count_is_approximate'] = (
+                self.page.paginator.count_is_approximate
+            )
+            return response
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_cursor_link(self.next_position, False)),
+            ('previous', self.get_cursor_link(self.previous_position, True)),
+            ('results', data)
+        ]))
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        if any(not isinstance(field, str) or '__' in field
+               for field in ordering):
+            raise NotFound('Сортировка не поддерживает курсор.')
+        pk_name = queryset.model._meta.pk.name
+        if not {pk_name, '-' + pk_name, 'pk', '-pk'} & set(ordering):
+            ordering.append('-' + pk_name)
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def after(ordering, position):
+        """Условие «строго после position» для составного ключа."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(position, list)
+            or len(position) != len(self.ordering)
+            or not all(isinstance(value, (int, float, str))
+                       for value in position)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_cursor_link(self, position, reverse):
+        if position is None:
+            return None
+        encoded = urlsafe_b64encode(
+            json.dumps({'p': position, 'r': reverse}).encode()
+        ).decode()
+        url = remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
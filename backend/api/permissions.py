@@ -12,6 +12,6 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         return (
-            obj.author == request.user
+            obj.author_id == request.user.id
             or request.user.is_superuser
         )
@@ -1,30 +1,32 @@
 from django.db import transaction
-from django.db.models import F
 from rest_framework import serializers
 
-from api.fields import Base64ImageField
+from api.fields import (Base64ImageField, BulkPrimaryKeyRelatedField,
+                        RecipeImagesField)
+from api.mixins import SerializerTimingMixin
 from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag)
+from services import images, membership, shopping_cart
 from services.validators import ingredients_validator, tags_validator
 from users.serializers import UserSerializer
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-    )
+    # Существование ингредиентов проверяется одним запросом
+    # в RecipeWriteSerializer.validate_ingredients.
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientRecipe
@@ -32,12 +34,15 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
 
 
 class MiniRecipeSerializer(serializers.ModelSerializer):
+    images = RecipeImagesField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(SerializerTimingMixin,
+                             serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
     image = Base64ImageField(source='recipe.image', read_only=True)
@@ -64,9 +69,23 @@ class FavoritesSerializer(ShoppingCartSerializer):
         )
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class RecipeReadSerializer(SerializerTimingMixin,
+                           serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     image = Base64ImageField(required=True, allow_null=True)
+    images = RecipeImagesField()
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -83,45 +102,53 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time'
         )
 
     def get_ingredients(self, obj):
-        return obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('ingredientrecipe__amount'),
-        )
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount
+            }
+            for item in obj.ingredientrecipe_set.all()
+        ]
 
     def get_tags(self, obj):
-        return obj.tags.values(
-            'id',
-            'name',
-            'color',
-            'slug'
-        )
+        return TagSerializer(obj.tags.all(), many=True).data
+
+    def get_recipe_ids(self, kind):
+        # Один набор на запрос, общий для всех рецептов списка.
+        key = f'{kind}_recipe_ids'
+        if key not in self.context:
+            self.context[key] = membership.get_recipe_ids(
+                self.context['request'].user, kind
+            )
+        return self.context[key]
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return user.shopping_cart.filter(recipe=obj).exists()
+        return obj.id in self.get_recipe_ids(membership.SHOPPING_CART)
 
     def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return user.favorites.filter(recipe=obj).exists()
+        return obj.id in self.get_recipe_ids(membership.FAVORITES)
+
+    def to_representation(self, instance):
+        # Флаг подписки посчитан в queryset, передаем его автору.
+        instance.author.is_subscribed = instance.is_subscribed
+        return super().to_representation(instance)
 
 
-class RecipeWriteSerializer(serializers.ModelSerializer):
+class RecipeWriteSerializer(SerializerTimingMixin,
+                            serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     image = Base64ImageField(required=True, allow_null=True)
     ingredients = IngredientRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(),
+                                      many=True)
 
     class Meta:
         model = Recipe
@@ -137,51 +164,121 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         )
 
     def validate_ingredients(self, value):
-        ingredients_validator(value)
-        return value
+        found = ingredients_validator(value)
+        return [
+            {'id': found[ingredient['id']], 'amount': ingredient['amount']}
+            for ingredient in value
+        ]
 
     def validate_tags(self, value):
         tags_validator(value)
         return value
 
     def create_ingredients(self, ingredients, recipe):
-        ingredients_list = []
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            ingredient_id = ingredient['id'].id
-            ingredients_list.append(
-                IngredientRecipe(
-                    ingredient_id=ingredient_id,
-                    recipe=recipe,
-                    amount=amount
-                )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                ingredient_id=ingredient_id,
+                recipe=recipe,
+                amount=amount
             )
-        with transaction.atomic():
-            IngredientRecipe.objects.bulk_create(ingredients_list)
+            for ingredient_id, amount in ingredients.items()
+        )
+
+    def create_tags(self, tags, recipe):
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag_id=tag_id)
+            for tag_id in tags
+        )
+
+    def update_ingredients(self, ingredients, recipe):
+        """Удаляет, добавляет и обновляет только измененные ингредиенты."""
+        current = {
+            item.ingredient_id: item
+            for item in recipe.ingredientrecipe_set.all()
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in current.items()
+        }
+        removed = [
+            item.pk for ingredient_id, item in current.items()
+            if ingredient_id not in ingredients
+        ]
+        changed = []
+        added = {}
+        for ingredient_id, amount in ingredients.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                added[ingredient_id] = amount
+            elif item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+
+        if removed:
+            IngredientRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            self.create_ingredients(added, recipe)
+        shopping_cart.change_recipe(recipe, old_amounts, ingredients)
+
+    def update_tags(self, tags, recipe):
+        current = set(Recipe.tags.through.objects.filter(
+            recipe=recipe
+        ).values_list('tag_id', flat=True))
+        removed = current - tags
+        if removed:
+            Recipe.tags.through.objects.filter(
+                recipe=recipe,
+                tag_id__in=removed
+            ).delete()
+        if tags - current:
+            self.create_tags(tags - current, recipe)
 
     def create(self, validated_data):
-        ingredients = validated_data.pop('ingredients')
+        ingredients = self.ingredient_amounts(
+            validated_data.pop('ingredients')
+        )
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        self.create_ingredients(ingredients=ingredients, recipe=recipe)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            self.create_tags({tag.id for tag in tags}, recipe)
+            self.create_ingredients(ingredients, recipe)
+            if recipe.image:
+                images.schedule(recipe)
         return recipe
 
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-
-        if ingredients:
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients=ingredients, recipe=instance)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if 'image' in validated_data:
+            validated_data['image_processed'] = False
 
-        if tags:
-            instance.tags.clear()
-            instance.tags.set(tags)
-
-        return super().update(instance, validated_data)
+        with transaction.atomic():
+            if ingredients:
+                shopping_cart.lock_recipes([instance.id])
+                self.update_ingredients(
+                    self.ingredient_amounts(ingredients),
+                    instance
+                )
+            if tags:
+                self.update_tags({tag.id for tag in tags}, instance)
+            instance = super().update(instance, validated_data)
+            if 'image' in validated_data and instance.image:
+                images.schedule(instance)
+            return instance
+
+    @staticmethod
+    def ingredient_amounts(ingredients):
+        return {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return RecipeReadSerializer(instance, context=context).data
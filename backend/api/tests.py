@@ -0,0 +1,757 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+from base64 import urlsafe_b64encode
+from threading import Barrier, Event, Thread
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorites, Ingredient, Recipe,
+                            ShoppingCartIngredient, Tag)
+from services import (catalogue, fake_data, instrumentation, membership,
+                      metrics, recipe_counters, shopping_cart)
+from services.ingredient_index import IngredientIndex
+from services.membership import MembershipCache
+from services.token_cache import TokenCache
+from services.utils import get_cart_etag
+from users.models import Subscribe
+
+User = get_user_model()
+THREADS = 8
+
+
+def run_in_threads(functions):
+    """Вызывает функции одновременно, каждую в своем потоке.
+
+    Возвращает результаты или исключения вызовов.
+    """
+    barrier = Barrier(len(functions))
+    results = [None] * len(functions)
+
+    def target(index):
+        try:
+            barrier.wait()
+            results[index] = functions[index]()
+        except Exception as error:
+            results[index] = error
+        finally:
+            connection.close()
+
+    threads = [Thread(target=target, args=(index,))
+               for index in range(len(functions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+    page_sizes = (2, 6, 20)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = fake_data.generate(
+            users=5, recipes=30, ingredients=20, seed=1
+        )[0]
+
+    def setUp(self):
+        # Кэш хранит COUNT(*) страниц и версии наборов избранного.
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_list_queries(self, expected):
+        if connection.vendor == 'postgresql':
+            # Оценка числа строк из pg_class перед COUNT(*).
+            expected += 1
+        for page_size in self.page_sizes:
+            with self.subTest(limit=page_size):
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': page_size}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), page_size)
+
+    def test_anonymous(self):
+        self.assert_list_queries(4)
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_list_queries(6)
+
+
+class EmptyListsTest(TestCase):
+    """Новый пользователь без избранного, корзины и подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        fake_data.generate(users=3, recipes=10, ingredients=10, seed=1)
+        cls.user = User.objects.create_user(
+            username='new', email='new@example.com', password='password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_empty_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['results'], [])
+
+    def test_recipe_filters(self):
+        for url in ('/api/recipes/?is_favorited=1',
+                    '/api/recipes/?is_in_shopping_cart=1'):
+            with self.subTest(url=url):
+                self.assert_empty_page(url)
+
+    def test_subscriptions(self):
+        for url in ('/api/users/subscriptions/',
+                    '/api/users/subscriptions/?recipes_limit=3'):
+            with self.subTest(url=url):
+                self.assert_empty_page(url)
+
+
+class CursorPaginationTest(TestCase):
+    """Режим ?cursor= отдает те же рецепты, что и постраничный."""
+
+    @classmethod
+    def setUpTestData(cls):
+        fake_data.generate(users=5, recipes=30, ingredients=20, seed=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['count'])
+        return response.data
+
+    def walk(self, params):
+        """Страницы по ссылкам next, затем обратно по previous."""
+        pages = [self.get('/api/recipes/', {**params, 'cursor': ''})]
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        backward = [pages[-1]]
+        while backward[-1]['previous']:
+            backward.append(self.get(backward[-1]['previous']))
+        ids = [[recipe['id'] for recipe in page['results']]
+               for page in pages]
+        backward_ids = [[recipe['id'] for recipe in page['results']]
+                        for page in reversed(backward)]
+        self.assertEqual(backward_ids, ids)
+        return [recipe_id for page in ids for recipe_id in page]
+
+    def expected(self, params):
+        response = self.client.get('/api/recipes/', {**params, 'limit': 100})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_round_trip(self):
+        for params in ({},
+                       {'ordering': '-favorites_count'},
+                       {'ordering': 'cooking_time'},
+                       {'search': 'Рецепт 1'}):
+            with self.subTest(params=params):
+                params['limit'] = 4
+                ids = self.walk(params)
+                self.assertGreater(len(ids), 4)
+                self.assertEqual(ids, self.expected(params))
+
+    def test_invalid_cursor(self):
+        for cursor in ('not base64', {'p': 5, 'r': 0}, {'p': [1, 2]},
+                       {'p': [[1]], 'r': 0}, {'p': ['id'], 'r': 0},
+                       {'p': [1, 2], 'r': 0}, [1]):
+            if not isinstance(cursor, str):
+                cursor = urlsafe_b64encode(json.dumps(cursor).encode())
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(NPLUSONE_ENABLED=True, NPLUSONE_RAISE=True)
+class NPlusOneTest(TestCase):
+    """Точки API не повторяют один SQL-запрос для каждой строки.
+
+    NPlusOneMiddleware в строгом режиме выбрасывает NPlusOneError.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        fake_data.generate(
+            users=10, recipes=60, ingredients=30, subscriptions=6, seed=2
+        )
+        cls.user = User.objects.annotate(
+            total=Count('subscriber')
+        ).order_by('-total').first()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_endpoints(self):
+        recipe_id = Recipe.objects.values_list('id', flat=True).first()
+        for url in ('/api/recipes/?limit=20',
+                    '/api/recipes/?is_favorited=1&limit=20',
+                    f'/api/recipes/{recipe_id}/',
+                    '/api/users/?limit=20',
+                    '/api/users/subscriptions/?limit=20&recipes_limit=5'):
+            with self.subTest(url=url):
+                try:
+                    response = self.client.get(url)
+                except instrumentation.NPlusOneError as error:
+                    self.fail(str(error))
+                self.assertEqual(response.status_code, 200)
+
+
+class CatalogueCacheTest(TestCase):
+    """Условный GET справочников и смена ETag при их изменении."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+    def assert_not_modified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_tags(self):
+        etag = self.assert_not_modified('/api/tags/')
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 2)
+
+    def test_ingredient_search(self):
+        url = '/api/ingredients/?name=со'
+        etag = self.assert_not_modified(url)
+        Ingredient.objects.create(name='соус', measurement_unit='мл')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            ['соль', 'соус']
+        )
+
+    def test_unavailable_shared_cache(self):
+        with mock.patch(
+            'services.catalogue.cache', DummyCache('dummy', {})
+        ):
+            version = catalogue.get_state(catalogue.TAGS)['version']
+            self.assertEqual(
+                catalogue.get_state(catalogue.TAGS)['version'], version
+            )
+            catalogue.bump(catalogue.TAGS)
+            self.assertNotEqual(
+                catalogue.get_state(catalogue.TAGS)['version'], version
+            )
+
+
+class MetricsRegistryTest(SimpleTestCase):
+    """Файлы метрик процессов в METRICS_DIR."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry = metrics.Registry(directory.name, 60)
+
+    def write(self, pid, value):
+        with open(os.path.join(self.registry.directory, f'{pid}.json'),
+                  'w', encoding='utf-8') as file:
+            json.dump({'counters': {'foodgram_requests_total': {
+                'key': value
+            }}, 'histograms': {}}, file)
+
+    def test_tests_do_not_use_server_directory(self):
+        self.assertNotEqual(metrics.registry.directory, settings.METRICS_DIR)
+
+    def test_files_of_finished_processes_are_removed(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        self.write(process.pid, 5)
+        self.write(os.getppid(), 2)
+        counters, _ = self.registry.collect()
+        self.assertEqual(counters['foodgram_requests_total']['key'], 2)
+        self.assertEqual(
+            sorted(os.listdir(self.registry.directory)),
+            sorted([f'{os.getpid()}.json', f'{os.getppid()}.json'])
+        )
+
+
+class IngredientIndexTest(TestCase):
+    """Поиск ингредиентов по индексу в памяти."""
+
+    def setUp(self):
+        cache.clear()
+        for name in ('ванильный сахар', 'сахар', 'сахарная пудра', 'соль',
+                     'свёкла', 'свекольный сок'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        self.index = IngredientIndex()
+
+    def search(self, query, limit=None):
+        return [item['name'] for item in self.index.search(query, limit)]
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(
+            self.search('Сах'),
+            ['сахар', 'сахарная пудра', 'ванильный сахар']
+        )
+
+    def test_yo_folding(self):
+        self.assertEqual(self.search('свек'), ['свёкла', 'свекольный сок'])
+        self.assertEqual(self.search('свёк'), ['свёкла', 'свекольный сок'])
+
+    def test_limit(self):
+        self.assertEqual(self.search('сах', 2), ['сахар', 'сахарная пудра'])
+        self.assertEqual(
+            self.search('сах', 3),
+            ['сахар', 'сахарная пудра', 'ванильный сахар']
+        )
+        self.assertEqual(self.search('ар', 1), ['ванильный сахар'])
+
+    def test_rebuild_after_change(self):
+        self.search('сах')
+        with self.assertNumQueries(0):
+            self.search('сах')
+        Ingredient.objects.create(name='сахарин', measurement_unit='г')
+        with self.assertNumQueries(1):
+            self.assertIn('сахарин', self.search('сах'))
+        Ingredient.objects.filter(name='сахар').delete()
+        self.assertNotIn('сахар', self.search('сах'))
+
+
+class MembershipCacheTest(TestCase):
+    """Наборы избранного в памяти процесса и их версии."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = fake_data.generate(
+            users=3, recipes=10, ingredients=10,
+            favorites=0, carts=0, subscriptions=0
+        )
+        cls.recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)
+        )
+        Favorites.objects.create(
+            user=cls.users[0], recipe_id=cls.recipe_ids[0]
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.membership = MembershipCache(2, 60)
+
+    def get(self, user):
+        return self.membership.get(user.id, membership.FAVORITES)
+
+    def test_hit_and_miss(self):
+        user = self.users[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(user), {self.recipe_ids[0]})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(user), {self.recipe_ids[0]})
+        stats = self.membership.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_update_in_place(self):
+        user = self.users[0]
+        self.get(user)
+        self.membership.update(
+            user.id, membership.FAVORITES,
+            added=[self.recipe_ids[1]], removed=[self.recipe_ids[0]]
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(user), {self.recipe_ids[1]})
+
+    def test_update_reaches_other_process(self):
+        user = self.users[0]
+        other = MembershipCache(2, 60)
+        self.get(user)
+        other.get(user.id, membership.FAVORITES)
+        self.membership.update(
+            user.id, membership.FAVORITES, added=[self.recipe_ids[1]]
+        )
+        with self.assertNumQueries(1):
+            other.get(user.id, membership.FAVORITES)
+
+    def test_ttl(self):
+        user = self.users[0]
+        self.get(user)
+        expired = time.monotonic() + 61
+        with mock.patch('time.monotonic', return_value=expired):
+            with self.assertNumQueries(1):
+                self.get(user)
+        self.assertEqual(self.membership.stats()['misses'], 2)
+
+    def test_size_eviction(self):
+        for user in self.users:
+            self.get(user)
+        stats = self.membership.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+        with self.assertNumQueries(1):
+            self.get(self.users[0])
+        with self.assertNumQueries(0):
+            self.get(self.users[2])
+
+
+class TokenCacheTest(TestCase):
+    """Два экземпляра TokenCache ведут себя как два процесса gunicorn."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.workers = (TokenCache(100, 60), TokenCache(100, 60))
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.user
+
+    def test_workers_share_version(self):
+        for _ in range(5):
+            for worker in self.workers:
+                worker.get(self.token.key, self.load)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(sum(worker.hits for worker in self.workers), 8)
+
+    def test_token_delete_reaches_every_worker(self):
+        key = self.token.key
+        for worker in self.workers:
+            worker.get(key, self.load)
+        self.token.delete()
+        for worker in self.workers:
+            worker.get(key, self.load)
+        self.assertEqual(self.loads, 4)
+
+    def test_result_read_during_invalidation_is_not_cached(self):
+        first, second = self.workers
+
+        def load_while_logging_out():
+            # Другой процесс удаляет токен, пока этот читает базу.
+            second.invalidate(self.token.key)
+            return self.load()
+
+        first.get(self.token.key, load_while_logging_out)
+        first.get(self.token.key, self.load)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(first.hits, 0)
+
+    def test_logout_rejects_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(client.get('/api/users/me/').status_code, 401)
+
+
+class CartEtagTest(TestCase):
+    """ETag списка покупок меняется вместе с содержимым файла."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+
+    def set_cart(self, amounts):
+        ShoppingCartIngredient.objects.filter(user=self.user).delete()
+        ShoppingCartIngredient.objects.bulk_create(
+            ShoppingCartIngredient(
+                user=self.user,
+                ingredient=self.ingredients[index],
+                amount=amount
+            )
+            for index, amount in amounts.items()
+        )
+        return get_cart_etag(self.user, 'txt')
+
+    def test_different_carts(self):
+        # При id подряд у корзин одинаковы число строк, сумма amount
+        # и сумма amount * id.
+        first = self.set_cart({0: 2, 1: 2})
+        second = self.set_cart({0: 3, 2: 1})
+        self.assertNotEqual(first, second)
+
+    def test_ingredient_rename(self):
+        before = self.set_cart({0: 2})
+        ingredient = self.ingredients[0]
+        ingredient.name = 'новое название'
+        ingredient.save()
+        self.assertNotEqual(before, get_cart_etag(self.user, 'txt'))
+
+    def test_empty_cart(self):
+        self.assertIsNone(self.set_cart({}))
+
+
+class CartDownloadTest(TestCase):
+    """Выгрузка списка покупок в файл."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        ingredient = Ingredient.objects.create(
+            name='ингредиент', measurement_unit='г'
+        )
+        ShoppingCartIngredient.objects.create(
+            user=self.user, ingredient=ingredient, amount=5
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format):
+        return self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': file_format}
+        )
+
+    def test_txt(self):
+        response = self.download('txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'ингредиент (г) — 5\n'
+        )
+
+    def test_metrics_include_stream(self):
+        with mock.patch('services.metrics.observe_request') as observe:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.download('txt')
+                observe.assert_not_called()
+                b''.join(response.streaming_content)
+        observe.assert_called_once()
+        request_metrics = observe.call_args.args[3]
+        self.assertEqual(request_metrics.queries, len(captured))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PDF_FONT_PATH='/nonexistent/font.ttf')
+    def test_pdf_without_font(self):
+        response = self.download('pdf')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.streaming)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужны параллельные записи.')
+class CartTotalsConcurrencyTest(TransactionTestCase):
+    """Параллельное создание одной строки итогов списка покупок."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='ингредиент', measurement_unit='г'
+        )
+
+    def add(self):
+        with transaction.atomic():
+            shopping_cart.apply_deltas([self.user.id], {self.ingredient.id: 5})
+
+    def test_parallel_add_creates_one_row(self):
+        results = run_in_threads([self.add] * THREADS)
+        self.assertEqual(
+            [result for result in results if result is not None], []
+        )
+        self.assertEqual(
+            ShoppingCartIngredient.objects.get(user=self.user).amount,
+            5 * THREADS
+        )
+
+    def test_remove_deletes_emptied_row(self):
+        self.add()
+        with transaction.atomic():
+            shopping_cart.apply_deltas(
+                [self.user.id], {self.ingredient.id: -5}
+            )
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужны параллельные записи.')
+class ConcurrencyTestCase(TransactionTestCase):
+    """Параллельные запросы одного пользователя из нескольких потоков."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = fake_data.generate(
+            users=3, recipes=20, ingredients=20,
+            favorites=0, carts=0, subscriptions=0
+        )[0]
+        self.recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)[:10]
+        )
+
+    def request(self, method, url, data=None):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return getattr(client, method)(url, data, format='json')
+
+    def assert_consistent(self):
+        self.assertFalse(recipe_counters.mismatched().exists())
+        self.assertEqual(
+            shopping_cart.stored_totals(), shopping_cart.calculate_totals()
+        )
+
+
+class BatchConcurrencyTest(ConcurrencyTestCase):
+    """Параллельные пакетные запросы не учитывают рецепт дважды."""
+
+    def test_parallel_batches(self):
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            with self.subTest(url=url):
+                for method in ('post', 'delete'):
+                    responses = run_in_threads([lambda: self.request(
+                        method, url, {'recipes': self.recipe_ids}
+                    )] * THREADS)
+                    self.assertEqual(
+                        [response.status_code for response in responses],
+                        [200] * THREADS
+                    )
+                    self.assertEqual(
+                        sorted(recipe_id for response in responses
+                               for recipe_id in response.data['changed']),
+                        self.recipe_ids
+                    )
+                    self.assert_consistent()
+
+    def test_batch_with_single_requests(self):
+        recipe_id = self.recipe_ids[0]
+        responses = run_in_threads([
+            lambda: self.request(
+                'post', f'/api/recipes/{recipe_id}/shopping_cart/'
+            ),
+            lambda: self.request(
+                'post', '/api/recipes/shopping_cart/',
+                {'recipes': self.recipe_ids}
+            ),
+        ] * (THREADS // 2))
+        self.assertNotIn(
+            500, [response.status_code for response in responses]
+        )
+        self.assertEqual(
+            Recipe.objects.get(id=recipe_id).shopping_cart_count, 1
+        )
+        self.assert_consistent()
+
+
+class CartAndRecipeEditConcurrencyTest(ConcurrencyTestCase):
+    """Правка рецепта во время его добавления в корзину."""
+
+    def test_edit_while_adding(self):
+        recipe = Recipe.objects.get(id=self.recipe_ids[0])
+        ingredients = [
+            {'id': ingredient_id, 'amount': amount + 7}
+            for ingredient_id, amount
+            in shopping_cart.get_recipe_amounts(recipe.id).items()
+        ]
+        added = Event()
+        apply_deltas = shopping_cart.apply_deltas
+
+        def slow_apply_deltas(user_ids, deltas):
+            # Добавление держит транзакцию открытой, пока идет правка.
+            apply_deltas(user_ids, deltas)
+            if not added.is_set():
+                added.set()
+                time.sleep(0.5)
+
+        def add():
+            return self.request(
+                'post', f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+
+        def edit():
+            added.wait(5)
+            client = APIClient()
+            client.force_authenticate(recipe.author)
+            return client.patch(
+                f'/api/recipes/{recipe.id}/',
+                {'ingredients': ingredients}, format='json'
+            )
+
+        with mock.patch(
+            'services.shopping_cart.apply_deltas', slow_apply_deltas
+        ):
+            responses = run_in_threads([add, edit])
+        self.assertEqual(
+            [response.status_code for response in responses], [201, 200]
+        )
+        self.assert_consistent()
+
+
+class DuplicateRequestsConcurrencyTest(ConcurrencyTestCase):
+    """Из одинаковых параллельных запросов срабатывает ровно один."""
+
+    def assert_one_succeeds(self, method, url, success):
+        responses = run_in_threads(
+            [lambda: self.request(method, url)] * THREADS
+        )
+        self.assertEqual(
+            sorted(response.status_code for response in responses),
+            [success] + [400] * (THREADS - 1)
+        )
+
+    def test_favorite_and_shopping_cart(self):
+        recipe_id = self.recipe_ids[0]
+        for action, field in (('favorite', 'favorites_count'),
+                              ('shopping_cart', 'shopping_cart_count')):
+            with self.subTest(action=action):
+                url = f'/api/recipes/{recipe_id}/{action}/'
+                self.assert_one_succeeds('post', url, 201)
+                self.assertEqual(
+                    getattr(Recipe.objects.get(id=recipe_id), field), 1
+                )
+                self.assert_consistent()
+                self.assert_one_succeeds('delete', url, 204)
+                self.assertEqual(
+                    getattr(Recipe.objects.get(id=recipe_id), field), 0
+                )
+                self.assert_consistent()
+
+    def test_subscribe(self):
+        author = User.objects.exclude(id=self.user.id).first()
+        url = f'/api/users/{author.id}/subscribe/'
+        self.assert_one_succeeds('post', url, 201)
+        self.assertEqual(
+            Subscribe.objects.filter(user=self.user, author=author).count(), 1
+        )
+        self.assert_one_succeeds('delete', url, 204)
+        self.assertFalse(
+            Subscribe.objects.filter(user=self.user, author=author).exists()
+        )
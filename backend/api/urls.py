@@ -1,7 +1,8 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+from .views import (CacheStatsView, IngredientViewSet, MetricsView,
+                    RecipeViewSet, TagViewSet)
 
 router = routers.DefaultRouter()
 router.register(r'tags', TagViewSet)
@@ -9,5 +10,7 @@ router.register(r'ingredients', IngredientViewSet)
 router.register(r'recipes', RecipeViewSet)
 
 urlpatterns = [
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    re_path(r'^metrics/?$', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls))
 ]
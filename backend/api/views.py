@@ -1,29 +1,58 @@
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
+                                        SAFE_METHODS)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from api.filters import IngredientFilter, RecipeFilter
+from api.mixins import CatalogueCacheMixin
+from api.negotiations import IgnoreFormatNegotiation
 from api.paginations import CustomPagination
 from api.permissions import IsOwnerOrReadOnly
 from api.serializers import (FavoritesSerializer, IngredientSerializer,
-                             RecipeReadSerializer, RecipeWriteSerializer,
-                             ShoppingCartSerializer, TagSerializer)
+                             RecipeIdsSerializer, RecipeReadSerializer,
+                             RecipeWriteSerializer, ShoppingCartSerializer,
+                             TagSerializer)
 from recipes.models import Favorites, Ingredient, Recipe, ShoppingCart, Tag
-from services.utils import download_txt_cart
+from services import (catalogue, ingredient_index, membership, metrics,
+                      recipe_counters, shopping_cart)
+from services.token_cache import token_cache
+from services.utils import (CART_FORMATS, add_user_recipes, delete_returning,
+                            download_cart, get_cart_etag,
+                            insert_ignore_conflicts, pdf_font_available)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CatalogueCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    catalogue_name = catalogue.TAGS
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogueCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    catalogue_name = catalogue.INGREDIENTS
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit', '')
+        # Поиск по индексу в памяти дешевле чтения из кэша.
+        return self.cached_response(
+            request, lambda: Response(ingredient_index.ingredient_index.search(
+                name,
+                int(limit) if limit.isdigit() else None
+            )),
+            store=False
+        )
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -34,6 +63,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsOwnerOrReadOnly,)
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.with_related().with_user_flags(
+                self.request.user
+            )
+        return Recipe.objects.all()
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -45,45 +81,111 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @staticmethod
     def _handle_favorite_or_cart(self, request, pk, model_class,
                                  serializer_class, message):
+        # Повторы отсекает уникальное ограничение в базе, а не проверка
+        # exists(): так параллельные запросы не приводят к ошибке 500.
         user = self.request.user
 
-        try:
-            recipe = Recipe.objects.get(id=pk)
-        except Recipe.DoesNotExist:
-            if request.method == 'POST':
+        if request.method == 'POST':
+            recipe = Recipe.objects.filter(id=pk).first()
+            if recipe is None:
                 return Response(
                     'Такого рецепта нет.',
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            return Response(
-                'Такого рецепта нет.',
-                status=status.HTTP_404_NOT_FOUND
+            with transaction.atomic():
+                if not insert_ignore_conflicts(
+                    model_class(user=user, recipe=recipe)
+                ):
+                    return Response(
+                        message['already_exists'],
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                recipe_counters.change(model_class, [recipe.id], 1)
+                if model_class is ShoppingCart:
+                    shopping_cart.add_recipes(user, [recipe.id])
+            membership.membership_cache.update(
+                user.id, membership.KINDS[model_class], added=[recipe.id]
+            )
+            serializer = serializer_class(
+                model_class(user=user, recipe=recipe)
             )
-        if request.method == 'POST':
-            if model_class.objects.filter(user=user, recipe=recipe).exists():
-                return Response(
-                    message['already_exists'],
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            serializer = serializer_class(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save(user=user, recipe=recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        # Проверка для соответсвия документации api.
-        if not model_class.objects.filter(user=user, recipe=recipe).exists():
+        with transaction.atomic():
+            deleted, _ = model_class.objects.filter(
+                user=user, recipe_id=pk
+            ).delete()
+            if deleted:
+                recipe_counters.change(model_class, [pk], -deleted)
+                if model_class is ShoppingCart:
+                    shopping_cart.remove_recipes(user, [pk])
+        if not deleted:
+            if not Recipe.objects.filter(id=pk).exists():
+                return Response(
+                    'Такого рецепта нет.',
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            # Проверка для соответсвия документации api.
             return Response(
                 message['not_found'],
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        model_class.objects.filter(user=user, recipe=recipe).delete()
+        membership.membership_cache.update(
+            user.id, membership.KINDS[model_class], removed=[int(pk)]
+        )
         return Response(
             message['deleted'],
             status=status.HTTP_204_NO_CONTENT
         )
 
+    @staticmethod
+    def _handle_batch(request, model_class):
+        """Добавляет или удаляет список рецептов одной записью в базу.
+
+        DELETE без поля recipes очищает весь список пользователя.
+        """
+        user = request.user
+        recipe_ids = None
+        if request.method == 'POST' or 'recipes' in request.data:
+            serializer = RecipeIdsSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            recipe_ids = serializer.validated_data['recipes']
+
+        # Счетчики, итоги и ответ строятся по строкам, которые база
+        # действительно добавила или удалила, поэтому параллельные
+        # запросы не учитываются дважды.
+        with transaction.atomic():
+            if request.method == 'POST':
+                done = add_user_recipes(model_class, user.id, recipe_ids)
+            else:
+                user_recipes = model_class.objects.filter(user=user)
+                if recipe_ids is not None:
+                    user_recipes = user_recipes.filter(
+                        recipe_id__in=recipe_ids
+                    )
+                done = delete_returning(user_recipes, 'recipe')
+            changed = [recipe_id for recipe_id
+                       in (recipe_ids or sorted(done))
+                       if recipe_id in done]
+            delta = 1 if request.method == 'POST' else -1
+            recipe_counters.change(model_class, changed, delta)
+            if model_class is ShoppingCart:
+                if request.method == 'POST':
+                    shopping_cart.add_recipes(user, changed)
+                else:
+                    shopping_cart.remove_recipes(user, changed)
+
+        kind = membership.KINDS[model_class]
+        if request.method == 'POST':
+            membership.membership_cache.update(user.id, kind, added=changed)
+        else:
+            membership.membership_cache.update(user.id, kind, removed=changed)
+        return Response({
+            'changed': changed,
+            'skipped': [recipe_id for recipe_id in recipe_ids or ()
+                        if recipe_id not in done]
+        })
+
     @action(
         methods=['post', 'delete'],
         detail=True,
@@ -115,13 +217,72 @@ class RecipeViewSet(viewsets.ModelViewSet):
                                              ShoppingCartSerializer, message)
 
     @action(
-        methods=['get'],
+        methods=['post', 'delete'],
         detail=False,
+        url_path='favorite',
+        url_name='favorite-batch',
         permission_classes=[IsAuthenticated]
     )
+    def favorite_batch(self, request):
+        return self._handle_batch(request, Favorites)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_batch(self, request):
+        return self._handle_batch(request, ShoppingCart)
+
+    @action(
+        methods=['get'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        content_negotiation_class=IgnoreFormatNegotiation
+    )
     def download_shopping_cart(self, request):
         user = self.request.user
-        if user.shopping_cart.exists():
-            cart = user.shopping_cart.all()
-            return download_txt_cart(cart)
-        return Response('Список пуст.', status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in CART_FORMATS:
+            return Response(
+                'Неизвестный формат файла.',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        etag = get_cart_etag(user, file_format)
+        if etag is None:
+            return Response('Список пуст.', status=status.HTTP_400_BAD_REQUEST)
+        if file_format == 'pdf' and not pdf_font_available():
+            return Response(
+                'Выгрузка в PDF недоступна: не найден шрифт.',
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = download_cart(user, file_format)
+        response['ETag'] = etag
+        return response
+
+
+class CacheStatsView(APIView):
+    """Счетчики кэшей текущего процесса для персонала."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'membership': membership.membership_cache.stats(),
+            'auth_token': token_cache.stats(),
+        })
+
+
+class MetricsView(APIView):
+    """Метрики всех процессов в текстовом формате Prometheus."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(*metrics.registry.collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -19,6 +19,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -29,6 +30,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -36,6 +38,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilerMiddleware',
+    'api.middleware.NPlusOneMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram_backend.urls'
@@ -61,7 +65,7 @@ WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
@@ -71,6 +75,46 @@ DATABASES = {
 }
 
 
+# Общий для процессов gunicorn кэш: версии кэшей в памяти процессов,
+# число строк страниц и ответы справочников. Без CACHE_LOCATION кэш
+# живет в памяти одного процесса, что годится только для разработки
+# и тестов.
+CACHE_LOCATION = config('CACHE_LOCATION', default='')
+CACHE_BACKEND = config(
+    'CACHE_BACKEND',
+    default=(
+        'django.core.cache.backends.memcached.PyMemcacheCache'
+        if CACHE_LOCATION
+        else 'django.core.cache.backends.locmem.LocMemCache'
+    )
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        # Недоступный memcached дает промахи, а не ошибки запросов.
+        'OPTIONS': (
+            {'ignore_exc': True} if CACHE_BACKEND.endswith('PyMemcacheCache')
+            else {}
+        ),
+    }
+}
+
+CATALOGUE_CACHE_TIMEOUT = config(
+    'CATALOGUE_CACHE_TIMEOUT', default=60 * 60, cast=int
+)
+
+PAGINATION_COUNT_TTL = config('PAGINATION_COUNT_TTL', default=30, cast=int)
+PAGINATION_ESTIMATE_THRESHOLD = config(
+    'PAGINATION_ESTIMATE_THRESHOLD', default=100000, cast=int
+)
+
+MEMBERSHIP_CACHE_SIZE = config('MEMBERSHIP_CACHE_SIZE', default=10000, cast=int)
+MEMBERSHIP_CACHE_TTL = config('MEMBERSHIP_CACHE_TTL', default=5 * 60, cast=int)
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+TOKEN_CACHE_TTL = config('TOKEN_CACHE_TTL', default=5 * 60, cast=int)
+
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -106,6 +150,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+IMAGE_QUEUE_SIZE = config('IMAGE_QUEUE_SIZE', default=100, cast=int)
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -113,12 +160,62 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
 }
 
 
+PDF_FONT_PATH = config(
+    'PDF_FONT_PATH',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+
+INSTRUMENTATION_ENABLED = config(
+    'INSTRUMENTATION_ENABLED', default=True, cast=bool
+)
+SLOW_REQUEST_THRESHOLD_MS = config(
+    'SLOW_REQUEST_THRESHOLD_MS', default=500, cast=int
+)
+SLOW_REQUEST_SAMPLE_RATE = config(
+    'SLOW_REQUEST_SAMPLE_RATE', default=1.0, cast=float
+)
+PROFILER_ENABLED = config('PROFILER_ENABLED', default=True, cast=bool)
+PROFILER_TOP_FUNCTIONS = config(
+    'PROFILER_TOP_FUNCTIONS', default=40, cast=int
+)
+
+NPLUSONE_ENABLED = config('NPLUSONE_ENABLED', default=DEBUG, cast=bool)
+NPLUSONE_RAISE = config('NPLUSONE_RAISE', default=False, cast=bool)
+NPLUSONE_THRESHOLD = config('NPLUSONE_THRESHOLD', default=3, cast=int)
+
+METRICS_DIR = config('METRICS_DIR', default='/tmp/foodgram_metrics')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5, cast=int)
+
+TEST_RUNNER = 'foodgram_backend.test_runner.TestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'default',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': config('LOG_LEVEL', default='INFO'),
+    },
+}
+
+
 DJOSER = {
     'LOGIN_FIELD': 'email'
 }
@@ -0,0 +1,21 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+
+from services import metrics
+
+
+class TestRunner(DiscoverRunner):
+    """Метрики тестового прогона пишутся во временный каталог,
+    а не в METRICS_DIR работающего сервера."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        self.old_metrics_dir = metrics.registry.directory
+        metrics.registry.directory = self.metrics_dir.name
+
+    def teardown_test_environment(self, **kwargs):
+        metrics.registry.directory = self.old_metrics_dir
+        self.metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
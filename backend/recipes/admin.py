@@ -2,32 +2,119 @@ from django.contrib import admin
 
 from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag)
+from services import images, shopping_cart
 from users.models import Subscribe
 
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
     search_fields = ('name',)
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
+    ordering = ('name',)
+    show_full_result_count = False
+
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'color', 'slug')
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+
+
+class IngredientRecipeInline(admin.TabularInline):
+    model = IngredientRecipe
+    autocomplete_fields = ('ingredient',)
+    min_num = 1
+    extra = 0
 
 
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'name',
         'author',
-        'in_favorite'
+        'in_favorite',
+        'shopping_cart_count'
     )
-    search_fields = ('name',)
-    list_filter = ('name', 'author', 'tags')
+    search_fields = ('name', 'author__username', 'author__email')
+    list_filter = ('tags',)
+    list_select_related = ('author',)
+    autocomplete_fields = ('author', 'tags')
+    readonly_fields = (
+        'favorites_count', 'shopping_cart_count', 'image_processed'
+    )
+    inlines = (IngredientRecipeInline,)
+    show_full_result_count = False
 
+    @admin.display(description='В избранном', ordering='favorites_count')
     def in_favorite(self, obj):
-        return obj.in_favorites.all().count()
+        return obj.favorites_count
+
+    def save_model(self, request, obj, form, change):
+        # Как и в RecipeWriteSerializer.update: копии старого изображения
+        # не подходят новому, пока пул не создаст новые.
+        image_changed = 'image' in form.changed_data
+        if image_changed:
+            obj.image_processed = False
+        super().save_model(request, obj, form, change)
+        if image_changed and obj.image:
+            images.schedule(obj)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not IngredientRecipe:
+            return super().save_formset(request, form, formset, change)
+        recipe = form.instance
+        shopping_cart.lock_recipes([recipe.id])
+        old_amounts = (
+            shopping_cart.get_recipe_amounts(recipe.id) if change else {}
+        )
+        super().save_formset(request, form, formset, change)
+        shopping_cart.change_recipe(
+            recipe,
+            old_amounts,
+            shopping_cart.get_recipe_amounts(recipe.id)
+        )
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Только просмотр: записи меняются через API, где вместе с ними
+    обновляются счетчики рецептов, итоги списков покупок и кэш наборов.
+    Ингредиенты рецепта правятся во вкладке рецепта."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class IngredientRecipeAdmin(ReadOnlyAdmin):
+    list_display = ('recipe', 'ingredient', 'amount')
+    search_fields = ('recipe__name', 'ingredient__name')
+    list_select_related = ('recipe__author', 'ingredient')
+    show_full_result_count = False
+
+
+class UserRecipeAdmin(ReadOnlyAdmin):
+    list_display = ('user', 'recipe')
+    search_fields = ('user__username', 'user__email', 'recipe__name')
+    list_select_related = ('user', 'recipe__author')
+    show_full_result_count = False
+
+
+class SubscribeAdmin(admin.ModelAdmin):
+    list_display = ('user', 'author')
+    search_fields = ('user__username', 'author__username')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
 
 
 admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(Tag)
+admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
-admin.site.register(IngredientRecipe)
-admin.site.register(Favorites)
-admin.site.register(ShoppingCart)
-admin.site.register(Subscribe)
+admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
+admin.site.register(Favorites, UserRecipeAdmin)
+admin.site.register(ShoppingCart, UserRecipeAdmin)
+admin.site.register(Subscribe, SubscribeAdmin)
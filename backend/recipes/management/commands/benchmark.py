@@ -0,0 +1,379 @@
+import json
+import math
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.utils.encoding import iri_to_uri
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Tag
+from services import fake_data, instrumentation
+from services.utils import pdf_font_available
+
+User = get_user_model()
+
+DEFAULT_LIMITS = os.path.join(settings.BASE_DIR, 'benchmark_limits.json')
+PERCENTILES = (50, 95, 99)
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+# Сколько рецептов пользователь замеров добавляет в избранное и корзину
+# и на скольких авторов подписывается перед замерами.
+PREPARED_RECIPES = 10
+PREPARED_AUTHORS = 3
+
+Scenario = namedtuple(
+    'Scenario',
+    ('name', 'method', 'url', 'data', 'anonymous', 'save_as', 'empty_user'),
+    defaults=(None, False, None, False)
+)
+
+
+def recipe_data(context, amount=10):
+    return {
+        'ingredients': [
+            {'id': ingredient_id, 'amount': amount}
+            for ingredient_id in context['ingredients']
+        ],
+        'tags': context['tags'],
+        'image': IMAGE,
+        'name': 'Рецепт для замера',
+        'text': 'Описание рецепта для замера.',
+        'cooking_time': 15
+    }
+
+
+SCENARIOS = (
+    Scenario('recipes-list', 'get', '/api/recipes/'),
+    Scenario('recipes-list-anonymous', 'get', '/api/recipes/',
+             anonymous=True),
+    Scenario('recipes-list-tags', 'get',
+             '/api/recipes/?tags={tag_slugs[0]}&tags={tag_slugs[1]}'),
+    Scenario('recipes-list-author', 'get', '/api/recipes/?author={author}'),
+    Scenario('recipes-list-favorited', 'get',
+             '/api/recipes/?is_favorited=1'),
+    Scenario('recipes-list-shopping-cart', 'get',
+             '/api/recipes/?is_in_shopping_cart=1'),
+    Scenario('recipes-list-favorited-empty', 'get',
+             '/api/recipes/?is_favorited=1', empty_user=True),
+    Scenario('recipes-list-shopping-cart-empty', 'get',
+             '/api/recipes/?is_in_shopping_cart=1', empty_user=True),
+    Scenario('recipes-list-search', 'get', '/api/recipes/?search=Рецепт 1'),
+    Scenario('recipes-list-ordering', 'get',
+             '/api/recipes/?ordering=-favorites_count'),
+    Scenario('recipes-list-deep-page', 'get', '/api/recipes/?page={page}'),
+    Scenario('recipes-list-cursor', 'get', '/api/recipes/?cursor='),
+    Scenario('recipe-detail', 'get', '/api/recipes/{recipe}/'),
+    Scenario('users-list', 'get', '/api/users/'),
+    Scenario('users-me', 'get', '/api/users/me/'),
+    Scenario('subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3'),
+    Scenario('subscriptions-empty', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', empty_user=True),
+    Scenario('download-shopping-cart-txt', 'get',
+             '/api/recipes/download_shopping_cart/?format=txt'),
+    Scenario('download-shopping-cart-csv', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv'),
+    Scenario('download-shopping-cart-pdf', 'get',
+             '/api/recipes/download_shopping_cart/?format=pdf'),
+    Scenario('tags-list', 'get', '/api/tags/'),
+    Scenario('ingredients-search', 'get', '/api/ingredients/?name=ингр'),
+    Scenario('recipe-create', 'post', '/api/recipes/', recipe_data,
+             save_as='new_recipe'),
+    Scenario('recipe-update', 'patch', '/api/recipes/{new_recipe}/',
+             lambda context: recipe_data(context, amount=20)),
+    Scenario('recipe-delete', 'delete', '/api/recipes/{new_recipe}/'),
+    Scenario('favorite-add', 'post', '/api/recipes/{free_recipe}/favorite/'),
+    Scenario('favorite-remove', 'delete',
+             '/api/recipes/{free_recipe}/favorite/'),
+    Scenario('shopping-cart-add', 'post',
+             '/api/recipes/{free_recipe}/shopping_cart/'),
+    Scenario('shopping-cart-remove', 'delete',
+             '/api/recipes/{free_recipe}/shopping_cart/'),
+    Scenario('shopping-cart-batch-add', 'post', '/api/recipes/shopping_cart/',
+             lambda context: {'recipes': context['free_recipes']}),
+    Scenario('shopping-cart-batch-remove', 'delete',
+             '/api/recipes/shopping_cart/',
+             lambda context: {'recipes': context['free_recipes']}),
+    Scenario('subscribe', 'post', '/api/users/{free_author}/subscribe/'),
+    Scenario('unsubscribe', 'delete', '/api/users/{free_author}/subscribe/'),
+)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def get_scenarios(only=None):
+    scenarios = [
+        scenario for scenario in SCENARIOS
+        if not only or only in scenario.name
+    ]
+    if not pdf_font_available():
+        scenarios = [scenario for scenario in scenarios
+                     if not scenario.name.endswith('-pdf')]
+    return scenarios
+
+
+def load_limits(path=DEFAULT_LIMITS):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def exceeded(results, limits):
+    return [
+        name for name, result in results.items()
+        if name in limits and result['queries'] > limits[name]
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет временную базу, замеряет задержки и число SQL-запросов '
+        'для каждой точки API и сверяет их с лимитами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--ingredients', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Сколько раз вызывать каждую точку (после прогрева).'
+        )
+        parser.add_argument(
+            '--only',
+            help='Замерять только сценарии, в имени которых есть строка.'
+        )
+        parser.add_argument('--limits', default=DEFAULT_LIMITS)
+        parser.add_argument(
+            '--update-limits',
+            action='store_true',
+            help='Записать наблюдаемое число запросов как новые лимиты.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Сохранить результаты в JSON-файл.'
+        )
+        parser.add_argument(
+            '--n-plus-one',
+            action='store_true',
+            help='Падать, если запрос повторяет один и тот же SQL '
+                 'больше NPLUSONE_THRESHOLD раз.'
+        )
+
+    def handle(self, *args, **options):
+        scenarios = get_scenarios(options['only'])
+        limits = load_limits(options['limits'])
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            results = self.measure(scenarios, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results, limits)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=4)
+        if options['update_limits']:
+            limits.update({
+                name: result['queries'] for name, result in results.items()
+            })
+            with open(options['limits'], 'w', encoding='utf-8') as file:
+                json.dump(limits, file, ensure_ascii=False, indent=4,
+                          sort_keys=True)
+                file.write('\n')
+            self.stdout.write(f'Лимиты записаны в {options["limits"]}.')
+            return
+
+        names = exceeded(results, limits)
+        if names:
+            raise CommandError(
+                'Превышен лимит запросов: ' + ', '.join(names)
+            )
+
+    def measure(self, scenarios, options):
+        """Заполняет текущую базу и замеряет сценарии.
+
+        База должна быть пустой: handle() создает для этого тестовую,
+        тесты вызывают метод в своей.
+        """
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                NPLUSONE_ENABLED=options['n_plus_one'],
+                NPLUSONE_RAISE=True,
+                # COUNT(*) не кэшируется: самый дорогой запрос списка
+                # попадает в каждый замер, а не только в прогрев.
+                PAGINATION_COUNT_TTL=0,
+                CACHES={'default': {
+                    'BACKEND':
+                        'django.core.cache.backends.locmem.LocMemCache'
+                }}
+            ):
+                return self.run(scenarios, options)
+
+    def run(self, scenarios, options):
+        self.stdout.write('Заполнение базы...')
+        users = fake_data.generate(
+            users=options['users'],
+            recipes=options['recipes'],
+            ingredients=options['ingredients'],
+            seed=options['seed']
+        )
+        user = min(users, key=lambda user: user.id)
+        client = self.get_client(user)
+        # Новый пользователь без избранного, корзины и подписок.
+        empty_client = self.get_client(User.objects.create_user(
+            username='benchmark', email='benchmark@example.com'
+        ))
+        free_author = max(users, key=lambda user: user.id)
+        self.prepare_user(client, user, free_author)
+        context = self.get_context(user, free_author)
+        anonymous = APIClient()
+
+        timings = {scenario.name: [] for scenario in scenarios}
+        queries = {scenario.name: 0 for scenario in scenarios}
+        # Первый проход прогревает кэши процесса и не учитывается.
+        for round_number in range(options['repeat'] + 1):
+            for scenario in scenarios:
+                data = scenario.data
+                if callable(data):
+                    data = data(context)
+                url = iri_to_uri(scenario.url.format(**context))
+                if scenario.anonymous:
+                    request_client = anonymous
+                elif scenario.empty_user:
+                    request_client = empty_client
+                else:
+                    request_client = client
+                request = getattr(request_client, scenario.method)
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    try:
+                        response = request(url, data, format='json')
+                    except instrumentation.NPlusOneError as error:
+                        raise CommandError(f'{scenario.name}: {error}')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - start
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f'{scenario.name}: {response.status_code} '
+                        f'{getattr(response, "data", "")}'
+                    )
+                if scenario.save_as:
+                    context[scenario.save_as] = response.data['id']
+                if round_number:
+                    timings[scenario.name].append(elapsed * 1000)
+                    queries[scenario.name] = max(
+                        queries[scenario.name], len(captured)
+                    )
+        return {
+            name: {
+                'queries': queries[name],
+                **{f'p{percent}_ms': round(percentile(values, percent), 2)
+                   for percent in PERCENTILES}
+            }
+            for name, values in timings.items()
+        }
+
+    @staticmethod
+    def get_client(user):
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    @staticmethod
+    def prepare_user(client, user, free_author):
+        """Одинаковое начальное состояние при любых seed и размерах.
+
+        С пустым избранным, корзиной или подписками фильтры и списки
+        пропускают запросы, и их число зависело бы от данных.
+        """
+        recipe_ids = list(Recipe.objects.order_by('id').values_list(
+            'id', flat=True
+        )[:PREPARED_RECIPES])
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            response = client.post(url, {'recipes': recipe_ids}, format='json')
+            if response.status_code >= 400:
+                raise CommandError(f'{url}: {response.status_code}')
+        authors = Recipe.objects.exclude(
+            author__in=(user, free_author)
+        ).order_by('author_id').values_list(
+            'author_id', flat=True
+        ).distinct()[:PREPARED_AUTHORS]
+        for author in authors:
+            if not user.subscriber.filter(author_id=author).exists():
+                client.post(f'/api/users/{author}/subscribe/')
+        if user.subscriber.filter(author=free_author).exists():
+            client.delete(f'/api/users/{free_author.id}/subscribe/')
+
+    @staticmethod
+    def get_context(user, free_author):
+        used = set(user.favorites.values_list('recipe_id', flat=True))
+        used |= set(user.shopping_cart.values_list('recipe_id', flat=True))
+        free_recipes = list(Recipe.objects.exclude(id__in=used).order_by(
+            'id'
+        ).values_list('id', flat=True)[:11])
+        author = Recipe.objects.values('author').annotate(
+            total=Count('id')
+        ).order_by('-total', 'author').values_list('author', flat=True)[0]
+        return {
+            'recipe': Recipe.objects.order_by('id').values_list(
+                'id', flat=True
+            )[0],
+            'author': author,
+            'page': max(Recipe.objects.count() // 6, 1),
+            'tag_slugs': list(Tag.objects.values_list('slug', flat=True)),
+            'tags': list(Tag.objects.values_list('id', flat=True)[:2]),
+            'ingredients': list(
+                Ingredient.objects.values_list('id', flat=True)[:5]
+            ),
+            'free_recipe': free_recipes[0],
+            'free_recipes': free_recipes[1:],
+            'free_author': free_author.id,
+        }
+
+    def report(self, results, limits):
+        self.stdout.write(
+            f'{"Сценарий":<30}{"SQL":>5}{"лимит":>7}'
+            + ''.join(f'{"p%d, мс" % percent:>11}'
+                      for percent in PERCENTILES)
+        )
+        for name, result in results.items():
+            limit = limits.get(name, '-')
+            line = (
+                f'{name:<30}{result["queries"]:>5}{limit:>7}'
+                + ''.join(f'{result[f"p{percent}_ms"]:>11.2f}'
+                          for percent in PERCENTILES)
+            )
+            if limit != '-' and result['queries'] > limit:
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
@@ -0,0 +1,75 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from services import fake_data
+
+DEFAULT_INGREDIENTS = os.path.join(
+    settings.BASE_DIR, '..', 'data', 'ingredients.csv'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает синтетических пользователей, рецепты, избранное, '
+        'списки покупок и подписки для нагрузочных проверок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--favorites',
+            type=float,
+            default=10,
+            help='Среднее число рецептов в избранном у пользователя.'
+        )
+        parser.add_argument(
+            '--carts',
+            type=float,
+            default=5,
+            help='Среднее число рецептов в списке покупок.'
+        )
+        parser.add_argument(
+            '--subscriptions',
+            type=float,
+            default=5,
+            help='Среднее число подписок пользователя.'
+        )
+        parser.add_argument(
+            '--exponent',
+            type=float,
+            default=1.1,
+            help='Показатель закона Ципфа для популярности.'
+        )
+        parser.add_argument(
+            '--ingredients',
+            default=DEFAULT_INGREDIENTS,
+            help='CSV-файл с ингредиентами (название,единица).'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['ingredients']):
+            raise CommandError(f'Файл {options["ingredients"]} не найден.')
+        start = time.monotonic()
+
+        def log(message):
+            self.stdout.write(f'[{time.monotonic() - start:7.1f} с] {message}')
+
+        fake_data.generate(
+            users=options['users'],
+            recipes=options['recipes'],
+            ingredients_path=options['ingredients'],
+            favorites=options['favorites'],
+            carts=options['carts'],
+            subscriptions=options['subscriptions'],
+            exponent=options['exponent'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            log=log
+        )
+        self.stdout.write(self.style.SUCCESS('Данные созданы.'))
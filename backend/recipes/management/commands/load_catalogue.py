@@ -0,0 +1,113 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import Ingredient, Tag
+from services import catalogue
+
+DEFAULT_PATHS = (
+    os.path.join(settings.BASE_DIR, '..', 'data', 'ingredients.csv'),
+    os.path.join(settings.BASE_DIR, 'dump.json'),
+)
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if len(row) == 2:
+                yield Ingredient(name=row[0], measurement_unit=row[1])
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as file:
+        rows = json.load(file)
+    for row in rows:
+        if 'model' not in row:
+            yield Ingredient(**row)
+        elif row['model'] == 'recipes.ingredient':
+            yield Ingredient(**row['fields'])
+        elif row['model'] == 'recipes.tag':
+            yield Tag(**row['fields'])
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает каталог ингредиентов и тэгов пакетами. '
+        'Уже существующие записи пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            help='Файлы .csv или .json; по умолчанию data/ingredients.csv '
+                 'и dump.json.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество записей в одном INSERT.'
+        )
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [
+            path for path in DEFAULT_PATHS if os.path.exists(path)
+        ]
+        if not paths:
+            raise CommandError('Не найдено ни одного файла для загрузки.')
+
+        before = self.counts()
+        started = time.perf_counter()
+        read = 0
+        for path in paths:
+            reader = READERS.get(os.path.splitext(path)[1].lower())
+            if reader is None:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+            read += self.load(reader(path), options['batch_size'])
+        elapsed = time.perf_counter() - started
+        after = self.counts()
+
+        if after[Ingredient] != before[Ingredient]:
+            catalogue.bump(catalogue.INGREDIENTS)
+        if after[Tag] != before[Tag]:
+            catalogue.bump(catalogue.TAGS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано записей: {read} за {elapsed:.2f} с '
+            f'({read / elapsed if elapsed else read:.0f} записей/с). '
+            f'Добавлено ингредиентов: '
+            f'{after[Ingredient] - before[Ingredient]}, '
+            f'тэгов: {after[Tag] - before[Tag]}.'
+        ))
+
+    @staticmethod
+    def counts():
+        return {model: model.objects.count() for model in (Ingredient, Tag)}
+
+    @staticmethod
+    def load(objects, batch_size):
+        read = 0
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                return read
+            read += len(batch)
+            with transaction.atomic():
+                for model in (Ingredient, Tag):
+                    model.objects.bulk_create(
+                        [obj for obj in batch if isinstance(obj, model)],
+                        ignore_conflicts=True
+                    )
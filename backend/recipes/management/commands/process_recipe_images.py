@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from services.images import make_variants
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные WebP-копии изображений рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии и для уже обработанных рецептов.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            recipes = recipes.filter(image_processed=False)
+        processed = failed = 0
+        for recipe_id, name in recipes.values_list('id', 'image').iterator():
+            try:
+                make_variants(name)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+                continue
+            Recipe.objects.filter(pk=recipe_id, image=name).update(
+                image_processed=True
+            )
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}, ошибок: {failed}.'
+        ))
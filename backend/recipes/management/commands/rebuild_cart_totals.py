@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from services.shopping_cart import (calculate_totals, rebuild_totals,
+                                    stored_totals)
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает итоги списков покупок и сверяет их с корзинами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить таблицу итогов, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            with transaction.atomic():
+                rebuild_totals()
+            self.stdout.write('Итоги списков покупок пересобраны.')
+
+        expected = calculate_totals()
+        stored = stored_totals()
+        mismatches = 0
+        for user_id in expected.keys() | stored.keys():
+            user_expected = expected.get(user_id, {})
+            user_stored = stored.get(user_id, {})
+            for ingredient_id in user_expected.keys() | user_stored.keys():
+                live = user_expected.get(ingredient_id)
+                saved = user_stored.get(ingredient_id)
+                if live != saved:
+                    mismatches += 1
+                    self.stdout.write(
+                        f'Пользователь {user_id}, ингредиент '
+                        f'{ingredient_id}: в таблице {saved}, '
+                        f'по корзине {live}'
+                    )
+        if mismatches:
+            raise CommandError(f'Расхождений: {mismatches}.')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from services.recipe_counters import COUNTER_FIELDS, mismatched, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счетчики избранного и корзины с реальными записями.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только показать расхождения, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        fields = list(COUNTER_FIELDS.values())
+        wrong = 0
+        for recipe in mismatched().iterator():
+            wrong += 1
+            counters = ', '.join(
+                f'{field}: {getattr(recipe, field)} -> '
+                f'{getattr(recipe, "actual_" + field)}'
+                for field in fields
+            )
+            self.stdout.write(f'Рецепт {recipe.id}: {counters}')
+
+        if options['check']:
+            if wrong:
+                raise CommandError(f'Расхождений: {wrong}.')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        if wrong:
+            reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено рецептов: {wrong}.'
+        ))
@@ -1,14 +1,30 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import (BooleanField, Case, Exists, FloatField, OuterRef,
+                              Prefetch, Q, Value, When)
 
 from recipes.constants import (MAX_INGREDIENT_NAME_LENGTH,
                                MAX_MEASUREMENT_UNIT_LENGTH,
                                MAX_RECIPE_NAME_LENGTH, MAX_TAG_COLOR_LENGTH,
                                MAX_TAG_NAME_LENGTH, MIN_COOKING_TIME)
+from users.models import Subscribe
 
 User = get_user_model()
 
+SEARCH_CONFIG = 'russian'
+COUNTER_FIELDS = ('favorites_count', 'shopping_cart_count')
+
+
+def recipe_search_vector():
+    """Вектор поиска рецепта; совпадает с выражением GIN-индекса."""
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
 
 class Ingredient(models.Model):
     name = models.CharField(
@@ -20,6 +36,14 @@ class Ingredient(models.Model):
         max_length=MAX_MEASUREMENT_UNIT_LENGTH
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
+
     def __str__(self):
         return f'{self.name} - {self.measurement_unit}'
 
@@ -41,6 +65,61 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Автор одним JOIN, тэги и ингредиенты — пакетными запросами."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredientrecipe_set',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            )
+        )
+
+    def with_user_flags(self, user):
+        """Флаг подписки на автора через Exists.
+
+        Флаги избранного и корзины берутся из services.membership.
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author')
+            ))
+        )
+
+    def search(self, query):
+        """Полнотекстовый и нечеткий поиск, отсортированный по релевантности.
+
+        На PostgreSQL используются GIN-индексы по вектору и триграммам
+        названия, на других базах — поиск через LIKE.
+        """
+        if connection.vendor != 'postgresql':
+            return self.filter(
+                Q(name__icontains=query) | Q(text__icontains=query)
+            ).annotate(rank=Case(
+                When(name__icontains=query, then=Value(1.0)),
+                default=Value(0.5),
+                output_field=FloatField()
+            )).order_by('-rank', '-id')
+
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return self.annotate(
+            search=recipe_search_vector(),
+            rank=(
+                SearchRank(recipe_search_vector(), search_query)
+                + TrigramSimilarity('name', query)
+            )
+        ).filter(
+            Q(search=search_query) | Q(name__trigram_similar=query)
+        ).order_by('-rank', '-id')
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -58,6 +137,18 @@ class Recipe(models.Model):
         null=True,
         default=None
     )
+    image_processed = models.BooleanField(
+        'Копии изображения готовы',
+        default=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0
+    )
     text = models.TextField(
         'Текст рецепта',
         help_text='О чем ваш рецепт?'
@@ -77,12 +168,36 @@ class Recipe(models.Model):
         validators=[MinValueValidator(MIN_COOKING_TIME)]
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ['-id']
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=['-shopping_cart_count', '-id'],
+                name='recipe_cart_count_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.author}: {self.name}'
 
+    def save(self, *args, **kwargs):
+        # Счетчики меняются только через F() в services.recipe_counters:
+        # иначе сохранение формы записало бы значения, прочитанные
+        # до параллельного добавления в избранное или корзину.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class IngredientRecipe(models.Model):
     ingredient = models.ForeignKey(
@@ -151,3 +266,29 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
+
+
+class ShoppingCartIngredient(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь списка покупок'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Общее количество')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient} - {self.amount}'
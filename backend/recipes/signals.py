@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, Tag
+from services import catalogue, recipe_counters, shopping_cart
+
+User = get_user_model()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_cart_totals(sender, instance, **kwargs):
+    shopping_cart.lock_recipes([instance.id])
+    shopping_cart.change_recipe(
+        instance,
+        shopping_cart.get_recipe_amounts(instance.id),
+        {}
+    )
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_from_recipe_counters(sender, instance, **kwargs):
+    # Избранное и корзина пользователя удаляются каскадом, минуя счетчики.
+    for model_class in recipe_counters.COUNTER_FIELDS:
+        recipe_counters.change(
+            model_class,
+            model_class.objects.filter(user=instance).values('recipe_id'),
+            -1
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    catalogue.bump(catalogue.INGREDIENTS)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    catalogue.bump(catalogue.TAGS)
@@ -0,0 +1,82 @@
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, TransactionTestCase
+
+from recipes.admin import RecipeAdmin
+from recipes.management.commands import benchmark
+from recipes.models import Recipe
+from services import fake_data, recipe_counters
+
+User = get_user_model()
+
+
+class RecipeCountersTest(TestCase):
+    """Счетчики избранного и корзины совпадают с настоящими строками."""
+
+    def test_user_delete(self):
+        users = fake_data.generate(users=5, recipes=30, ingredients=20)
+        self.assertFalse(recipe_counters.mismatched().exists())
+        for user in users[:2]:
+            user.delete()
+        self.assertFalse(recipe_counters.mismatched().exists())
+
+
+class RecipeAdminTest(TestCase):
+    """Смена изображения в админке запускает создание копий заново."""
+
+    def setUp(self):
+        self.user = fake_data.generate(users=2, recipes=3, ingredients=5)[0]
+        self.user.is_superuser = self.user.is_staff = True
+        self.recipe = Recipe.objects.first()
+        self.admin = RecipeAdmin(Recipe, admin.site)
+        self.request = RequestFactory().post('/')
+        self.request.user = self.user
+
+    def save(self, changed_data):
+        with mock.patch('services.images.schedule') as schedule:
+            self.admin.save_model(
+                self.request, self.recipe,
+                SimpleNamespace(changed_data=changed_data), change=True
+            )
+        self.recipe.refresh_from_db()
+        return schedule
+
+    def test_image_change(self):
+        schedule = self.save(['image'])
+        self.assertFalse(self.recipe.image_processed)
+        schedule.assert_called_once_with(self.recipe)
+
+    def test_other_change(self):
+        schedule = self.save(['name'])
+        self.assertTrue(self.recipe.image_processed)
+        schedule.assert_not_called()
+
+    def test_flag_is_read_only(self):
+        form = self.admin.get_form(self.request, self.recipe)
+        self.assertNotIn('image_processed', form.base_fields)
+
+
+class BenchmarkTest(TransactionTestCase):
+    """Сценарии команды benchmark укладываются в benchmark_limits.json.
+
+    Как и сама команда, тест работает вне транзакции: иначе число
+    запросов отличалось бы от замеренного.
+    """
+
+    def test_limits(self):
+        command = benchmark.Command(stdout=StringIO())
+        results = command.measure(benchmark.get_scenarios(), {
+            'users': 10,
+            'recipes': 60,
+            'ingredients': 30,
+            'seed': 3,
+            'repeat': 1,
+            'n_plus_one': True,
+        })
+        limits = benchmark.load_limits()
+        self.assertEqual(set(results) - set(limits), set())
+        self.assertEqual(benchmark.exceeded(results, limits), [])
@@ -0,0 +1,52 @@
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+INGREDIENTS = 'ingredients'
+TAGS = 'tags'
+# Сколько секунд процесс держит свою версию, пока общий кэш недоступен.
+FALLBACK_TTL = 30
+
+_fallback = {}
+
+
+def _key(name):
+    return f'catalogue_version:{name}'
+
+
+def get_state(name):
+    """Версия и время последнего изменения справочника.
+
+    Хранятся в общем кэше без срока жизни, поэтому видны всем процессам.
+    """
+    state = cache.get(_key(name))
+    if state is None:
+        cache.add(_key(name), _new_state(), timeout=None)
+        state = cache.get(_key(name))
+    if state is None:
+        state = _fallback_state(name)
+    return state
+
+
+def _fallback_state(name):
+    """Версия процесса на случай недоступного общего кэша.
+
+    Новая версия на каждый вызов перестраивала бы индекс ингредиентов
+    и меняла ETag при каждом запросе. Своя версия живет FALLBACK_TTL
+    секунд: изменения из других процессов видны с этой задержкой.
+    """
+    expires, state = _fallback.get(name, (0, None))
+    if expires <= time.monotonic():
+        state = _new_state()
+        _fallback[name] = (time.monotonic() + FALLBACK_TTL, state)
+    return state
+
+
+def bump(name):
+    _fallback.pop(name, None)
+    cache.set(_key(name), _new_state(), timeout=None)
+
+
+def _new_state():
+    return {'version': uuid4().hex, 'modified': int(time.time())}
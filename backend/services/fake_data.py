@@ -0,0 +1,218 @@
+import csv
+import random
+from bisect import bisect
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from services import catalogue, recipe_counters, shopping_cart
+from users.models import Subscribe
+
+User = get_user_model()
+
+PASSWORD = 'foodgram-data'
+IMAGE_NAME = 'recipes/images/placeholder.png'
+MEASUREMENT_UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.')
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+class ZipfChoice:
+    """Случайный выбор из values с весами 1 / rank ** exponent.
+
+    Ранги раздаются в случайном порядке, чтобы популярными
+    оказывались не только первые id.
+    """
+
+    def __init__(self, rng, values, exponent):
+        self.rng = rng
+        self.values = list(values)
+        rng.shuffle(self.values)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.values) + 1)
+        ))
+
+    def __call__(self):
+        point = self.rng.random() * self.cum_weights[-1]
+        return self.values[bisect(self.cum_weights, point)]
+
+    def sample(self, count):
+        """До count разных значений; популярные выпадают чаще."""
+        count = min(count, len(self.values))
+        chosen = set()
+        for _ in range(count * 3):
+            chosen.add(self())
+            if len(chosen) == count:
+                break
+        return chosen
+
+
+def skewed_count(rng, mean):
+    """Количество с длинным хвостом: у большинства мало, у немногих много."""
+    return int(rng.expovariate(1 / mean)) if mean else 0
+
+
+def read_ingredients(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if len(row) == 2:
+                yield Ingredient(name=row[0], measurement_unit=row[1])
+
+
+def bulk_create(model_class, objects, batch_size, **kwargs):
+    """bulk_create по частям, не собирая все объекты в памяти."""
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return
+        model_class.objects.bulk_create(batch, **kwargs)
+
+
+def generate(users=50, recipes=500, ingredients=200, ingredients_path=None,
+             favorites=10, carts=5, subscriptions=5, exponent=1.1, seed=0,
+             batch_size=1000, log=None):
+    """Заполняет базу случайными, но воспроизводимыми данными.
+
+    Авторы, рецепты и ингредиенты выбираются по закону Ципфа,
+    число избранного, покупок и подписок на пользователя — с длинным
+    хвостом вокруг заданных средних. Ингредиенты читаются из
+    ingredients_path или создаются в количестве ingredients.
+    Возвращает созданных пользователей.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    for name, color, slug in TAGS:
+        Tag.objects.get_or_create(
+            slug=slug, defaults={'name': name, 'color': color}
+        )
+    tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    if ingredients_path:
+        new_ingredients = read_ingredients(ingredients_path)
+    else:
+        new_ingredients = (
+            Ingredient(
+                name=f'ингредиент {number}',
+                measurement_unit=rng.choice(MEASUREMENT_UNITS)
+            )
+            for number in range(ingredients)
+        )
+    bulk_create(
+        Ingredient, new_ingredients, batch_size, ignore_conflicts=True
+    )
+    catalogue.bump(catalogue.INGREDIENTS)
+    pick_ingredient = ZipfChoice(
+        rng,
+        Ingredient.objects.order_by('id').values_list('id', flat=True),
+        exponent
+    )
+    log(f'Ингредиентов: {len(pick_ingredient.values)}')
+
+    password = make_password(PASSWORD)
+    first_user = User.objects.order_by('-id').values_list(
+        'id', flat=True
+    ).first() or 0
+    bulk_create(
+        User,
+        (
+            User(
+                username=f'user{first_user + number}',
+                email=f'user{first_user + number}@example.com',
+                first_name=f'Имя {number}',
+                last_name=f'Фамилия {number}',
+                password=password
+            )
+            for number in range(users)
+        ),
+        batch_size
+    )
+    new_users = list(User.objects.filter(id__gt=first_user).order_by('id'))
+    user_ids = [user.id for user in new_users]
+    pick_author = ZipfChoice(rng, user_ids, exponent)
+    log(f'Пользователей: {len(user_ids)}')
+
+    first_recipe = Recipe.objects.order_by('-id').values_list(
+        'id', flat=True
+    ).first() or 0
+    bulk_create(
+        Recipe,
+        (
+            Recipe(
+                author_id=pick_author(),
+                name=f'Рецепт {number}',
+                text=f'Описание рецепта {number}.',
+                cooking_time=rng.randint(1, 180),
+                image=IMAGE_NAME,
+                image_processed=True
+            )
+            for number in range(recipes)
+        ),
+        batch_size
+    )
+    recipe_ids = list(Recipe.objects.filter(
+        id__gt=first_recipe
+    ).order_by('id').values_list('id', flat=True))
+    pick_recipe = ZipfChoice(rng, recipe_ids, exponent)
+    log(f'Рецептов: {len(recipe_ids)}')
+
+    bulk_create(
+        IngredientRecipe,
+        (
+            IngredientRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500)
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in pick_ingredient.sample(rng.randint(3, 12))
+        ),
+        batch_size
+    )
+    bulk_create(
+        Recipe.tags.through,
+        (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tag_ids, rng.randint(1, len(tag_ids)))
+        ),
+        batch_size
+    )
+    log('Ингредиенты и тэги рецептов созданы')
+
+    for model_class, mean in ((Favorites, favorites),
+                              (ShoppingCart, carts)):
+        bulk_create(
+            model_class,
+            (
+                model_class(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in pick_recipe.sample(skewed_count(rng, mean))
+            ),
+            batch_size
+        )
+    bulk_create(
+        Subscribe,
+        (
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in pick_author.sample(
+                skewed_count(rng, subscriptions)
+            )
+            if author_id != user_id
+        ),
+        batch_size
+    )
+    log('Избранное, списки покупок и подписки созданы')
+
+    recipe_counters.reconcile()
+    shopping_cart.rebuild_totals()
+    log('Счетчики и итоги списков покупок пересчитаны')
+    return new_users
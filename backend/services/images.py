@@ -0,0 +1,90 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import BoundedSemaphore
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZES = {
+    'thumbnail': (320, 320),
+    'card': (640, 640),
+    'full': (1280, 1280),
+}
+IMAGE_QUALITY = 80
+VARIANTS_DIR = 'sizes'
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+_slots = BoundedSemaphore(settings.IMAGE_QUEUE_SIZE)
+
+
+def variant_name(name, size):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, VARIANTS_DIR, f'{stem}_{size}.webp')
+
+
+def variant_names(name):
+    return {size: variant_name(name, size) for size in IMAGE_SIZES}
+
+
+def make_variants(name):
+    with default_storage.open(name) as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for size, bounds in IMAGE_SIZES.items():
+            variant = image.copy()
+            variant.thumbnail(bounds, Image.LANCZOS)
+            buffer = BytesIO()
+            variant.save(buffer, 'WEBP', quality=IMAGE_QUALITY)
+            path = variant_name(name, size)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def process_image(recipe_id, name):
+    """Создает уменьшенные WebP-копии и отмечает рецепт готовым."""
+    try:
+        make_variants(name)
+        Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_processed=True
+        )
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        connections.close_all()
+
+
+def _release(future):
+    _slots.release()
+
+
+def schedule(recipe):
+    """Ставит обработку изображения в пул после коммита транзакции.
+
+    Если очередь заполнена, рецепт остается с оригиналом до запуска
+    команды process_recipe_images.
+    """
+    recipe_id, name = recipe.id, recipe.image.name
+
+    def submit():
+        if not _slots.acquire(blocking=False):
+            logger.warning('Очередь обработки изображений заполнена')
+            return
+        _executor.submit(process_image, recipe_id, name).add_done_callback(
+            _release
+        )
+
+    transaction.on_commit(submit)
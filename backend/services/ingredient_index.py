@@ -0,0 +1,66 @@
+from bisect import bisect_left
+from threading import Lock
+
+from recipes.models import Ingredient
+from services import catalogue
+
+
+def normalize(name):
+    return name.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Отсортированный индекс названий ингредиентов в памяти процесса.
+
+    Строится при первом поиске и перестраивается, когда меняется версия
+    справочника ингредиентов (см. services.catalogue).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._keys = []
+        self._items = []
+
+    def _build(self):
+        rows = sorted(
+            (normalize(name), ingredient_id, name, measurement_unit)
+            for ingredient_id, name, measurement_unit
+            in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+        self._keys = [row[0] for row in rows]
+        self._items = [
+            {'id': row[1], 'name': row[2], 'measurement_unit': row[3]}
+            for row in rows
+        ]
+
+    def _ensure_fresh(self):
+        version = catalogue.get_state(catalogue.INGREDIENTS)['version']
+        if self._version == version:
+            return
+        with self._lock:
+            if self._version != version:
+                self._build()
+                self._version = version
+
+    def search(self, query, limit=None):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        self._ensure_fresh()
+        keys, items = self._keys, self._items
+        query = normalize(query)
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + '\U0010ffff', lo=start)
+        result = items[start:end]
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+        for position, key in enumerate(keys):
+            if query in key and not start <= position < end:
+                result.append(items[position])
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+import time
+import traceback
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_current = ContextVar('request_metrics', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+class RequestMetrics:
+    """Время и SQL-запросы одного запроса.
+
+    Экземпляр передается в connection.execute_wrapper и считает
+    количество и суммарное время запросов к базе.
+    """
+    __slots__ = (
+        'start', 'duration', 'queries', 'sql_time', 'serializer_time',
+        'in_serializer'
+    )
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.in_serializer = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def server_timing(self):
+        return (
+            f'total;dur={self.duration * 1000:.1f}, '
+            f'db;dur={self.sql_time * 1000:.1f};'
+            f'desc="{self.queries} queries", '
+            f'serializer;dur={self.serializer_time * 1000:.1f}'
+        )
+
+
+def activate(metrics):
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def fingerprint(sql):
+    """SQL без значений: запросы, отличающиеся только параметрами,
+    дают одинаковый отпечаток."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql.replace('%s', '?'))
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+class QueryLog:
+    """Запоминает каждый SQL-запрос и его время.
+
+    Как и RequestMetrics, передается в connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': repr(params)[:200],
+                'time_ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+    def repeated(self):
+        """Группы запросов с одинаковым отпечатком, начиная с частых."""
+        groups = defaultdict(lambda: {'count': 0, 'time_ms': 0.0})
+        for query in self.queries:
+            group = groups[fingerprint(query['sql'])]
+            group['count'] += 1
+            group['time_ms'] += query['time_ms']
+        return sorted(
+            (
+                {'fingerprint': sql, 'count': group['count'],
+                 'time_ms': round(group['time_ms'], 3)}
+                for sql, group in groups.items() if group['count'] > 1
+            ),
+            key=lambda group: -group['count']
+        )
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class NPlusOneDetector:
+    """Ищет запросы, повторенные в одном запросе больше threshold раз.
+
+    Передается в connection.execute_wrapper. Стек вызова сохраняется
+    только в момент превышения порога, поэтому обычные запросы
+    стоят одного подсчета отпечатка.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = defaultdict(int)
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        if self.counts[key] == self.threshold + 1:
+            self.stacks[key] = project_stack()
+        return execute(sql, params, many, context)
+
+    def problems(self):
+        return [
+            {'fingerprint': key, 'count': self.counts[key], 'stack': stack}
+            for key, stack in self.stacks.items()
+        ]
+
+    @staticmethod
+    def format(problems):
+        return '\n\n'.join(
+            f'{problem["count"]} x {problem["fingerprint"]}\n'
+            + ''.join(problem['stack'])
+            for problem in problems
+        )
+
+
+def project_stack():
+    """Кадры стека из кода проекта, без Django и сторонних пакетов."""
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(settings.BASE_DIR + os.sep)
+        and not frame.filename.startswith(sys.prefix)
+        and os.sep + 'site-packages' + os.sep not in frame.filename
+        and frame.filename != __file__
+    ]
+    return traceback.format_list(frames)
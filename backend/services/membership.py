@@ -0,0 +1,121 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Favorites, ShoppingCart
+from services import metrics
+from services.utils import get_or_add_version
+
+FAVORITES = 'favorites'
+SHOPPING_CART = 'shopping_cart'
+MODELS = {
+    FAVORITES: Favorites,
+    SHOPPING_CART: ShoppingCart,
+}
+KINDS = {model: kind for kind, model in MODELS.items()}
+
+
+def _version_key(user_id, kind):
+    return f'membership_version:{kind}:{user_id}'
+
+
+class MembershipCache:
+    """LRU-кэш id рецептов в избранном и корзине пользователя.
+
+    Наборы хранятся в памяти процесса с ограничением по размеру и TTL.
+    Версия каждого набора лежит в общем кэше: изменение в одном процессе
+    заставляет остальные перечитать набор из базы.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, kind):
+        key = (user_id, kind)
+        version = get_or_add_version(_version_key(user_id, kind), self.ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                version is not None
+                and entry is not None
+                and entry[0] > time.monotonic()
+                and entry[1] == version
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        recipe_ids = frozenset(MODELS[kind].objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True))
+        # Без версии в общем кэше изменение в другом процессе
+        # нельзя заметить, поэтому такой набор не запоминается.
+        if version is not None:
+            self._store(key, version, recipe_ids)
+        return recipe_ids
+
+    def update(self, user_id, kind, added=(), removed=()):
+        """Применяет изменение к набору, не перечитывая его из базы."""
+        key = (user_id, kind)
+        version = uuid4().hex
+        cache.set(_version_key(user_id, kind), version, self.ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return
+            recipe_ids = (entry[2] | frozenset(added)) - frozenset(removed)
+        self._store(key, version, recipe_ids)
+
+    def _store(self, key, version, recipe_ids):
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + self.ttl, version, recipe_ids
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / requests if requests else None,
+            }
+
+
+membership_cache = MembershipCache(
+    settings.MEMBERSHIP_CACHE_SIZE,
+    settings.MEMBERSHIP_CACHE_TTL
+)
+
+
+metrics.registry.add_collector(lambda: {
+    'foodgram_cache_hits_total': [
+        ({'cache': 'membership'}, membership_cache.hits)
+    ],
+    'foodgram_cache_misses_total': [
+        ({'cache': 'membership'}, membership_cache.misses)
+    ],
+})
+
+
+def get_recipe_ids(user, kind):
+    if user.is_anonymous:
+        return frozenset()
+    return membership_cache.get(user.id, kind)
@@ -0,0 +1,252 @@
+import json
+import os
+import tempfile
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+
+from django.conf import settings
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+HISTOGRAMS = {
+    'foodgram_request_duration_seconds': (
+        'Время обработки запроса.', DURATION_BUCKETS
+    ),
+    'foodgram_db_query_duration_seconds': (
+        'Суммарное время SQL-запросов за запрос.', DURATION_BUCKETS
+    ),
+    'foodgram_db_queries': (
+        'Число SQL-запросов за запрос.', QUERY_BUCKETS
+    ),
+}
+COUNTERS = {
+    'foodgram_requests_total': 'Число обработанных запросов.',
+    'foodgram_cache_hits_total': 'Попадания в кэш.',
+    'foodgram_cache_misses_total': 'Промахи кэша.',
+}
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+class Registry:
+    """Счетчики и гистограммы процесса.
+
+    Каждый процесс gunicorn раз в METRICS_FLUSH_INTERVAL секунд
+    записывает свои значения в отдельный файл в METRICS_DIR,
+    а collect() складывает файлы всех процессов. Файлы завершившихся
+    процессов collect() удаляет: их счетчики пропадают, как при
+    перезапуске процесса.
+    """
+
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._flushed = 0
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._histograms = defaultdict(dict)
+        self._collectors = []
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[name][_labels_key(labels)] += value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._histograms[name].get(key)
+            if series is None:
+                series = self._histograms[name][key] = {
+                    'buckets': [0] * (len(buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+            series['buckets'][bisect_left(buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def add_collector(self, collector):
+        """collector() возвращает {имя счетчика: [(labels, значение)]}.
+
+        Так в файл попадают счетчики, которые уже ведутся в другом
+        месте, например статистика кэшей.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        with self._lock:
+            counters = {
+                name: dict(series) for name, series in self._counters.items()
+            }
+            histograms = {
+                name: {key: dict(value, buckets=list(value['buckets']))
+                       for key, value in series.items()}
+                for name, series in self._histograms.items()
+            }
+        for collector in self._collectors:
+            for name, series in collector().items():
+                for labels, value in series:
+                    counters.setdefault(name, {})[_labels_key(labels)] = value
+        return {'counters': counters, 'histograms': histograms}
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        # Запись через временный файл, чтобы читатель не увидел
+        # недописанный JSON.
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, ensure_ascii=False)
+        # pid берется при записи: воркеры gunicorn создаются fork().
+        os.replace(
+            temporary, os.path.join(self.directory, f'{os.getpid()}.json')
+        )
+
+    def collect(self):
+        """Сумма значений из файлов всех процессов."""
+        self.flush()
+        counters = defaultdict(lambda: defaultdict(int))
+        histograms = defaultdict(dict)
+        for name in os.listdir(self.directory):
+            pid, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            path = os.path.join(self.directory, name)
+            if pid.isdigit() and not _process_exists(int(pid)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for metric, series in data['counters'].items():
+                for key, value in series.items():
+                    counters[metric][key] += value
+            for metric, series in data['histograms'].items():
+                for key, value in series.items():
+                    total = histograms[metric].get(key)
+                    if total is None:
+                        histograms[metric][key] = value
+                        continue
+                    total['buckets'] = [
+                        first + second for first, second
+                        in zip(total['buckets'], value['buckets'])
+                    ]
+                    total['sum'] += value['sum']
+                    total['count'] += value['count']
+        return counters, histograms
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_labels(pairs, **extra):
+    pairs = list(pairs) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+         .replace('\n', r'\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    """Текстовый формат Prometheus 0.0.4."""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for key, value in sorted(counters.get(name, {}).items()):
+            lines.append(
+                f'{name}{_format_labels(json.loads(key))} '
+                f'{_format_number(value)}'
+            )
+
+    hits = counters.get('foodgram_cache_hits_total', {})
+    misses = counters.get('foodgram_cache_misses_total', {})
+    lines += [
+        '# HELP foodgram_cache_hit_ratio Доля попаданий в кэш.',
+        '# TYPE foodgram_cache_hit_ratio gauge',
+    ]
+    for key in sorted(hits.keys() | misses.keys()):
+        total = hits.get(key, 0) + misses.get(key, 0)
+        if total:
+            lines.append(
+                f'foodgram_cache_hit_ratio{_format_labels(json.loads(key))} '
+                f'{_format_number(hits.get(key, 0) / total)}'
+            )
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, series in sorted(histograms.get(name, {}).items()):
+            pairs = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), series['buckets']):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{_format_labels(pairs, le=bound)} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'{name}_sum{_format_labels(pairs)} '
+                f'{_format_number(series["sum"])}'
+            )
+            lines.append(
+                f'{name}_count{_format_labels(pairs)} {series["count"]}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL)
+
+
+def observe_request(view, method, status, request_metrics):
+    labels = {'view': view}
+    registry.inc(
+        'foodgram_requests_total',
+        {'view': view, 'method': method, 'status': str(status)}
+    )
+    registry.observe(
+        'foodgram_request_duration_seconds', labels, request_metrics.duration
+    )
+    registry.observe(
+        'foodgram_db_query_duration_seconds', labels,
+        request_metrics.sql_time
+    )
+    registry.observe('foodgram_db_queries', labels, request_metrics.queries)
+    registry.maybe_flush()
+
+
+def cache_hit(cache_name, hit):
+    registry.inc(
+        'foodgram_cache_hits_total' if hit else 'foodgram_cache_misses_total',
+        {'cache': cache_name}
+    )
@@ -0,0 +1,46 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorites, Recipe, ShoppingCart
+
+COUNTER_FIELDS = {
+    Favorites: 'favorites_count',
+    ShoppingCart: 'shopping_cart_count',
+}
+
+
+def change(model_class, recipe_ids, delta):
+    """Атомарно меняет счетчик рецептов на delta через F()."""
+    if not delta:
+        return
+    field = COUNTER_FIELDS[model_class]
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        **{field: F(field) + delta}
+    )
+
+
+def actual_counts():
+    """Выражения с настоящими количествами для каждого счетчика."""
+    return {
+        field: Coalesce(Subquery(
+            model_class.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                total=Count('id')
+            ).values('total')
+        ), 0)
+        for model_class, field in COUNTER_FIELDS.items()
+    }
+
+
+def mismatched():
+    actual = {f'actual_{field}': value
+              for field, value in actual_counts().items()}
+    condition = Q()
+    for field in COUNTER_FIELDS.values():
+        condition |= ~Q(**{field: F(f'actual_{field}')})
+    return Recipe.objects.annotate(**actual).filter(condition)
+
+
+def reconcile():
+    Recipe.objects.update(**actual_counts())
@@ -0,0 +1,188 @@
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import (Case, F, PositiveIntegerField, Sum, Value,
+                              When)
+from django.db.models.functions import Greatest
+
+from recipes.models import (IngredientRecipe, Recipe, ShoppingCart,
+                            ShoppingCartIngredient)
+
+UPSERT_BATCH_SIZE = 500
+
+
+def lock_recipes(recipe_ids):
+    """Блокирует строки рецептов до конца транзакции.
+
+    Добавление рецепта в корзину и правка его ингредиентов берут эту
+    блокировку до чтения количеств. Иначе при READ COMMITTED правка
+    не видит еще не закоммиченную строку корзины, а добавление читает
+    старые количества, и итоги расходятся с рецептами.
+    """
+    list(Recipe.objects.select_for_update().filter(
+        id__in=recipe_ids
+    ).order_by('id').values_list('id', flat=True))
+
+
+def get_recipe_amounts(recipe_id):
+    return dict(IngredientRecipe.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', 'amount'))
+
+
+def apply_deltas(user_ids, deltas):
+    """Изменяет итоги списка покупок пользователей на deltas.
+
+    deltas — словарь {id ингредиента: изменение количества}.
+    Вызывается внутри транзакции, изменяющей корзину или рецепт.
+    Прибавки записываются через INSERT ... ON CONFLICT DO UPDATE,
+    поэтому параллельное создание одной строки итогов не нарушает
+    уникальность. Вычитания уменьшают существующие строки, после чего
+    удаляются строки с нулевым количеством.
+    """
+    user_ids = sorted(set(user_ids))
+    added = sorted(
+        (ingredient_id, delta)
+        for ingredient_id, delta in deltas.items() if delta > 0
+    )
+    removed = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta < 0
+    }
+    if not user_ids:
+        return
+
+    if added:
+        _upsert_totals([
+            (user_id, ingredient_id, delta)
+            for user_id in user_ids
+            for ingredient_id, delta in added
+        ])
+    if removed:
+        rows = ShoppingCartIngredient.objects.filter(
+            user_id__in=user_ids,
+            ingredient_id__in=removed
+        )
+        rows.update(amount=Greatest(
+            F('amount') + Case(
+                *(When(ingredient_id=ingredient_id, then=Value(delta))
+                  for ingredient_id, delta in removed.items()),
+                output_field=PositiveIntegerField()
+            ),
+            0
+        ))
+        rows.filter(amount__lte=0).delete()
+
+
+def _upsert_totals(rows):
+    """Прибавляет (user_id, ingredient_id, amount) к итогам, создавая
+    недостающие строки."""
+    model = ShoppingCartIngredient
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(
+        quote(model._meta.get_field(name).column)
+        for name in ('user', 'ingredient', 'amount')
+    )
+    amount = quote(model._meta.get_field('amount').column)
+    conflict = ', '.join(
+        quote(model._meta.get_field(name).column)
+        for name in ('user', 'ingredient')
+    )
+    # Строки отсортированы, поэтому параллельные транзакции блокируют
+    # их в одном порядке и не попадают во взаимную блокировку.
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES '
+                + ', '.join(['(%s, %s, %s)'] * len(batch))
+                + f' ON CONFLICT ({conflict}) DO UPDATE '
+                f'SET {amount} = {table}.{amount} + EXCLUDED.{amount}',
+                [value for row in batch for value in row]
+            )
+
+
+def get_recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов нескольких рецептов."""
+    return dict(IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id').annotate(
+        total_amount=Sum('amount')
+    ).values_list('ingredient_id', 'total_amount').order_by())
+
+
+def add_recipes(user, recipe_ids):
+    if recipe_ids:
+        lock_recipes(recipe_ids)
+        apply_deltas([user.id], get_recipes_amounts(recipe_ids))
+
+
+def remove_recipes(user, recipe_ids):
+    if recipe_ids:
+        lock_recipes(recipe_ids)
+        apply_deltas([user.id], {
+            ingredient_id: -amount
+            for ingredient_id, amount
+            in get_recipes_amounts(recipe_ids).items()
+        })
+
+
+def change_recipe(recipe, old_amounts, new_amounts):
+    """Переносит правку ингредиентов рецепта в списки покупок."""
+    deltas = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    if not any(deltas.values()):
+        return
+    user_ids = ShoppingCart.objects.filter(
+        recipe=recipe
+    ).values_list('user_id', flat=True)
+    apply_deltas(user_ids, deltas)
+
+
+def calculate_totals():
+    """Итоги по всем корзинам, посчитанные агрегацией по рецептам."""
+    totals = defaultdict(dict)
+    rows = IngredientRecipe.objects.filter(
+        recipe__in_shopping_cart__isnull=False
+    ).values(
+        'recipe__in_shopping_cart__user_id',
+        'ingredient_id'
+    ).annotate(total_amount=Sum('amount'))
+    for row in rows.iterator():
+        user_id = row['recipe__in_shopping_cart__user_id']
+        totals[user_id][row['ingredient_id']] = row['total_amount']
+    return totals
+
+
+def stored_totals():
+    totals = defaultdict(dict)
+    rows = ShoppingCartIngredient.objects.values_list(
+        'user_id', 'ingredient_id', 'amount'
+    )
+    for user_id, ingredient_id, amount in rows.iterator():
+        totals[user_id][ingredient_id] = amount
+    return totals
+
+
+def rebuild_totals():
+    ShoppingCartIngredient.objects.all().delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (
+            ShoppingCartIngredient(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for user_id, amounts in calculate_totals().items()
+            for ingredient_id, amount in amounts.items()
+        ),
+        batch_size=1000
+    )
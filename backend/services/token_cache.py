@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+
+from services import metrics
+from services.utils import get_or_add_version
+
+
+def _version_key(key):
+    # В ключ кэша попадает хэш, а не сам токен.
+    return f'auth_token_version:{sha256(key.encode()).hexdigest()}'
+
+
+class TokenCache:
+    """LRU-кэш токен -> пользователь с ограничением по размеру и TTL.
+
+    Как и в MembershipCache, версия записи лежит в общем кэше:
+    удаление токена или изменение пользователя в одном процессе
+    сразу делает записи остальных процессов недействительными.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """Пользователь токена key; при промахе его возвращает load().
+
+        Новую версию создает только инвалидация. Если версия сменилась,
+        пока load() читал базу, например токен удалили при выходе,
+        результат не запоминается.
+        """
+        version_key = _version_key(key)
+        version = get_or_add_version(version_key, self.ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                version is not None
+                and entry is not None
+                and entry[0] > time.monotonic()
+                and entry[1] == version
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        user = load()
+        if version is not None and cache.get(version_key) == version:
+            self._store(key, version, user)
+        return user
+
+    def _store(self, key, version, user):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        cache.delete_many([_version_key(key) for key in keys])
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        keys = list(Token.objects.filter(
+            user_id=user_id
+        ).values_list('key', flat=True))
+        if keys:
+            self.invalidate(*keys)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / requests if requests else None,
+            }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+metrics.registry.add_collector(lambda: {
+    'foodgram_cache_hits_total': [
+        ({'cache': 'auth_token'}, token_cache.hits)
+    ],
+    'foodgram_cache_misses_total': [
+        ({'cache': 'auth_token'}, token_cache.misses)
+    ],
+})
@@ -1,26 +1,143 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import csv
+from collections import defaultdict
+from functools import lru_cache
+from hashlib import md5
+from io import BytesIO
+from uuid import uuid4
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import F, Window, sql
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
+from django.utils.http import quote_etag
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
 
-def download_txt_cart(carts):
-    response = HttpResponse(content_type='text/plain')
-    filename = u'shopping-cart.txt'
-    response['Content-Disposition'] = f'attachment; filename={filename}'
+from recipes.models import Recipe, ShoppingCartIngredient
+from services import catalogue
+
+CART_CHUNK_SIZE = 2000
+PDF_FONT_NAME = 'CartFont'
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_MARGIN = 50
+
+
+def get_cart_ingredients(user):
+    return ShoppingCartIngredient.objects.filter(
+        user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        total_amount=F('amount')
+    ).order_by('ingredient__name')
+
+
+def get_cart_etag(user, file_format):
+    """ETag по строкам итогов списка покупок и версии справочника
+    ингредиентов: переименование ингредиента тоже меняет файл.
 
-    ingredients_total = carts.values(
-        'recipe__ingredients__name',
-        'recipe__ingredients__measurement_unit'
-    ).annotate(
-        total_amount=Sum('recipe__ingredientrecipe__amount')
-    ).order_by('recipe__ingredients__name')
-
-    for ingredient in ingredients_total:
-        response.write(
-            f'{ingredient["recipe__ingredients__name"]} '
-            f'({ingredient["recipe__ingredients__measurement_unit"]}) — '
-            f'{ingredient["total_amount"]}\n'
+    Возвращает None, если список пуст.
+    """
+    rows = list(ShoppingCartIngredient.objects.filter(
+        user=user
+    ).order_by('ingredient_id').values_list('ingredient_id', 'amount'))
+    if not rows:
+        return None
+    version = catalogue.get_state(catalogue.INGREDIENTS)['version']
+    digest = md5(f'{file_format}:{version}:{rows}'.encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def _cart_rows(user):
+    for ingredient in get_cart_ingredients(user).iterator(
+        chunk_size=CART_CHUNK_SIZE
+    ):
+        yield (
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['total_amount']
         )
 
+
+def _txt_cart(user):
+    for name, measurement_unit, amount in _cart_rows(user):
+        yield f'{name} ({measurement_unit}) — {amount}\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _csv_cart(user):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for row in _cart_rows(user):
+        yield writer.writerow(row)
+
+
+@lru_cache(maxsize=None)
+def _load_pdf_font(path):
+    font = TTFont(PDF_FONT_NAME, path)
+    pdfmetrics.registerFont(font)
+    return font
+
+
+def pdf_font_available():
+    """Загружает шрифт PDF_FONT_PATH один раз на процесс.
+
+    Вызывается до ответа: ошибка внутри генератора оборвала бы поток
+    после уже отправленного статуса 200.
+    """
+    try:
+        _load_pdf_font(settings.PDF_FONT_PATH)
+    except TTFError:
+        return False
+    return True
+
+
+def _pdf_cart(user):
+    # PDF ссылается на смещения объектов в конце файла,
+    # поэтому документ собирается целиком и отдается частями.
+    buffer = BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    page.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+    for name, measurement_unit, amount in _cart_rows(user):
+        if y < PDF_MARGIN:
+            page.showPage()
+            page.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        page.drawString(
+            PDF_MARGIN, y, f'{name} ({measurement_unit}) — {amount}'
+        )
+        y -= PDF_LINE_HEIGHT
+    page.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(CART_CHUNK_SIZE), b'')
+
+
+CART_FORMATS = {
+    'txt': (_txt_cart, 'text/plain; charset=utf-8'),
+    'csv': (_csv_cart, 'text/csv; charset=utf-8'),
+    'pdf': (_pdf_cart, 'application/pdf'),
+}
+
+
+def download_cart(user, file_format):
+    generator, content_type = CART_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        generator(user),
+        content_type=content_type
+    )
+    filename = f'shopping-cart.{file_format}'
+    response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 
 
@@ -28,3 +145,112 @@ def is_user_subscribed(user, author):
     if user.is_anonymous or user == author:
         return False
     return user.subscriber.filter(author=author).exists()
+
+
+def get_recipes_by_author(author_ids, limit=None):
+    """Рецепты авторов страницы одним запросом, не более limit на автора."""
+    recipes_by_author = defaultdict(list)
+    if not author_ids:
+        # Для author_id__in=[] Django не строит SQL (EmptyResultSet).
+        return recipes_by_author
+    recipes = Recipe.objects.filter(
+        author_id__in=author_ids
+    ).order_by('-id').only(
+        'id', 'name', 'image', 'image_processed', 'cooking_time', 'author'
+    )
+    if limit is not None:
+        ranked = recipes.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=F('id').desc()
+        ))
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE row_number <= %s '
+            'ORDER BY id DESC',
+            (*params, limit)
+        )
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    return recipes_by_author
+
+
+def insert_ignore_conflicts(obj):
+    """Сохраняет obj одним INSERT, пропуская нарушение уникальности.
+
+    Возвращает True, если строка добавлена, и False, если такая уже
+    есть. Сигналы post_save не отправляются.
+    """
+    model = type(obj)
+    using = router.db_for_write(model)
+    query = sql.InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [field for field in model._meta.local_concrete_fields
+         if not field.primary_key],
+        [obj]
+    )
+    (statement, params), = query.get_compiler(using).as_sql()
+    with connections[using].cursor() as cursor:
+        cursor.execute(statement, params)
+        return cursor.rowcount > 0
+
+
+def add_user_recipes(model_class, user_id, recipe_ids):
+    """Добавляет пользователю рецепты из recipe_ids одним
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Несуществующие рецепты и уже добавленные пропускаются.
+    Возвращает множество id рецептов, которые действительно добавлены.
+    """
+    using = router.db_for_write(model_class)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    user_column = quote(model_class._meta.get_field('user').column)
+    recipe_column = quote(model_class._meta.get_field('recipe').column)
+    recipe_ids = list(recipe_ids)
+    # Рецепты выбираются по порядку id, поэтому параллельные вставки
+    # ждут друг друга в одном порядке и не блокируют друг друга насмерть.
+    statement = (
+        f'INSERT INTO {quote(model_class._meta.db_table)} '
+        f'({user_column}, {recipe_column}) '
+        f'SELECT %s, {quote("id")} FROM {quote(Recipe._meta.db_table)} '
+        f'WHERE {quote("id")} IN ({", ".join(["%s"] * len(recipe_ids))}) '
+        f'ORDER BY {quote("id")} '
+        f'ON CONFLICT DO NOTHING RETURNING {recipe_column}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(statement, [user_id, *recipe_ids])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def delete_returning(queryset, field_name):
+    """Удаляет строки queryset одним DELETE ... RETURNING field_name.
+
+    Возвращает множество значений поля у удаленных строк.
+    Сигналы удаления не отправляются.
+    """
+    query = queryset.query.chain(sql.DeleteQuery)
+    compiler = query.get_compiler(queryset.db)
+    statement, params = compiler.as_sql()
+    column = queryset.model._meta.get_field(field_name).column
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            f'{statement} RETURNING '
+            f'{compiler.connection.ops.quote_name(column)}',
+            params
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def get_or_add_version(key, timeout):
+    """Версия из общего кэша; если ее нет, создается новая.
+
+    cache.add не перезаписывает версию, уже созданную другим процессом,
+    поэтому промах в одном процессе не сбрасывает записи остальных.
+    Возвращает None, если общий кэш недоступен.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout)
+        version = cache.get(key)
+    return version
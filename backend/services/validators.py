@@ -1,36 +1,51 @@
 from django.core.exceptions import ValidationError
 
-from recipes.models import Ingredient, Tag
+from recipes.models import Ingredient
+
+
+def _duplicates(ids):
+    seen = set()
+    duplicates = set()
+    for pk in ids:
+        if pk in seen:
+            duplicates.add(pk)
+        seen.add(pk)
+    return sorted(duplicates)
 
 
 def ingredients_validator(ingredients):
+    """Проверяет ингредиенты рецепта одним запросом к базе.
+
+    Возвращает словарь найденных ингредиентов {id: Ingredient}.
+    Все ошибки собираются и выбрасываются вместе.
+    """
     if not ingredients:
         raise ValidationError('Ингредиент не добавлен.')
 
-    ing_list = []
+    ids = [ingredient['id'] for ingredient in ingredients]
+    found = Ingredient.objects.in_bulk(set(ids))
+    errors = []
 
-    for ingredient in ingredients:
-        if not Ingredient.objects.filter(id=ingredient['id'].id).exists():
-            raise ValidationError('Такого ингредиента нет в базе.')
+    missing = sorted({pk for pk in ids if pk not in found})
+    if missing:
+        errors.append(f'Такого ингредиента нет в базе: {missing}.')
 
-        if ingredient in ing_list:
-            raise ValidationError('Такой ингридиент уже в списке.')
-        ing_list.append(ingredient)
+    duplicates = _duplicates(ids)
+    if duplicates:
+        errors.append(f'Такой ингридиент уже в списке: {duplicates}.')
 
-        if int(ingredient['amount']) <= 0:
-            raise ValidationError('Количество не может быть 0 или меньше.')
+    if any(int(ingredient['amount']) <= 0 for ingredient in ingredients):
+        errors.append('Количество не может быть 0 или меньше.')
+
+    if errors:
+        raise ValidationError(errors)
+    return found
 
 
 def tags_validator(tags):
     if not tags:
         raise ValidationError('Нет тега.')
 
-    tags_list = []
-
-    for tag in tags:
-        if not Tag.objects.filter(id=tag.id).exists():
-            raise ValidationError('Такого тэга нет в базе.')
-
-        if tag in tags_list:
-            raise ValidationError('Такой тэг уже в списке.')
-        tags_list.append(tag)
+    duplicates = _duplicates(tag.id for tag in tags)
+    if duplicates:
+        raise ValidationError(f'Такой тэг уже в списке: {duplicates}.')
@@ -4,6 +4,7 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
 import api.serializers
+from api.mixins import SerializerTimingMixin
 from recipes.models import Recipe
 from services.utils import is_user_subscribed
 from users.models import Subscribe
@@ -11,7 +12,7 @@ from users.models import Subscribe
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -27,6 +28,8 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('is_subscribed',)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return is_user_subscribed(user, obj)
 
@@ -49,7 +52,7 @@ class UserPostSerializer(UserCreateSerializer):
         )
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     email = serializers.ReadOnlyField(source='author.email')
     id = serializers.ReadOnlyField(source='author.id')
     username = serializers.ReadOnlyField(source='author.username')
@@ -73,15 +76,23 @@ class SubscribeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return is_user_subscribed(user, obj.author)
+        # Запись подписки принадлежит текущему пользователю.
+        return obj.user_id == self.context.get('request').user.id
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return Recipe.objects.filter(author=obj.author).count()
 
     def get_recipes(self, obj):
-        limit = self.context.get('request').query_params.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=obj.author)
-        if limit:
-            recipes = recipes.order_by('-id')[:int(limit)]
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author[obj.author_id]
+        else:
+            limit = self.context.get('request').query_params.get(
+                'recipes_limit'
+            )
+            recipes = Recipe.objects.filter(author=obj.author)
+            if limit:
+                recipes = recipes.order_by('-id')[:int(limit)]
         return api.serializers.MiniRecipeSerializer(recipes, many=True).data
@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.db.models import BooleanField, Count, Exists, OuterRef, Value
 from django.shortcuts import get_object_or_404
 from djoser.serializers import SetPasswordSerializer
 from rest_framework import status, viewsets
@@ -7,6 +8,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
 from api.paginations import CustomPagination
+from services.utils import get_recipes_by_author, insert_ignore_conflicts
 from users.models import Subscribe
 from users.serializers import (SubscribeSerializer, UserPostSerializer,
                                UserSerializer)
@@ -21,6 +23,18 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_anonymous:
+            is_subscribed = Value(False, output_field=BooleanField())
+        else:
+            is_subscribed = Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('pk')
+            ))
+        return User.objects.annotate(
+            is_subscribed=is_subscribed
+        ).order_by('id')
+
     def get_serializer_class(self):
         if self.action == 'create':
             return UserPostSerializer
@@ -62,35 +76,36 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscribe(self, request, *args, **kwargs):
         user = self.request.user
-        author = get_object_or_404(User, id=kwargs['pk'])
 
         if request.method == 'POST':
-            if Subscribe.objects.filter(author=author, user=user).exists():
+            author = get_object_or_404(User, id=kwargs['pk'])
+            if user == author:
                 return Response(
-                    'Вы уже подписаны.',
+                    'Нельзя подписаться на себя.',
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if user == author:
+            subscribe = Subscribe(user=user, author=author)
+            if not insert_ignore_conflicts(subscribe):
                 return Response(
-                    'Нельзя подписаться на себя.',
+                    'Вы уже подписаны.',
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
             serializer = SubscribeSerializer(
-                data=request.data,
+                subscribe,
                 context={'request': request}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save(user=user, author=author)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if Subscribe.objects.filter(author=author, user=user).exists():
-            Subscribe.objects.filter(author=author, user=user).first().delete()
+        deleted, _ = Subscribe.objects.filter(
+            author_id=kwargs['pk'], user=user
+        ).delete()
+        if deleted:
             return Response(
                 'Вы отписаны от автора.',
                 status=status.HTTP_204_NO_CONTENT
             )
 
+        get_object_or_404(User, id=kwargs['pk'])
         return Response(
             {'errors': 'Такой подписки нет.'},
             status=status.HTTP_400_BAD_REQUEST
@@ -103,11 +118,23 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscriptions(self, request):
         user = self.request.user
-        authors = Subscribe.objects.filter(user=user)
+        authors = Subscribe.objects.filter(user=user).select_related(
+            'author'
+        ).annotate(
+            recipes_count=Count('author__resipes')
+        ).order_by('id')
         pages = self.paginate_queryset(authors)
+        limit = request.query_params.get('recipes_limit')
+        recipes_by_author = get_recipes_by_author(
+            [subscribe.author_id for subscribe in pages],
+            int(limit) if limit else None
+        )
         serializer = SubscribeSerializer(
             pages,
             many=True,
-            context={'request': request}
+            context={
+                'request': request,
+                'recipes_by_author': recipes_by_author
+            }
         )
         return self.get_paginated_response(serializer.data)